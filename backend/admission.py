@@ -0,0 +1,102 @@
+"""Admission control and request deadlines for expensive routes.
+
+Each guarded route gets an AdmissionController: at most `max_concurrency`
+requests run at once, at most `max_queue` more wait for a slot, and a waiter
+that does not get one within `queue_timeout` is shed. Shed requests get a
+fast 503 with Retry-After instead of piling onto the Spotify fan-out.
+
+Admitted requests carry an absolute deadline in a context variable so
+outbound Spotify calls can shrink their timeouts to the time that is left.
+"""
+
+import asyncio
+import math
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+import httpx
+from fastapi import HTTPException
+
+request_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of time before an outbound call could start"""
+
+
+def remaining_time() -> Optional[float]:
+    """Seconds left for the current request, or None without a deadline"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def outbound_timeout(default: float) -> httpx.Timeout:
+    """httpx timeout capped by the current request deadline"""
+    remaining = remaining_time()
+    if remaining is None:
+        return httpx.Timeout(default)
+    if remaining <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return httpx.Timeout(min(default, remaining))
+
+
+class AdmissionController:
+    """Concurrency limit with a bounded, deadline-limited wait queue"""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float,
+                 request_timeout: Optional[float] = None):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.shed = 0
+
+    def _reject(self, reason: str):
+        self.shed += 1
+        retry_after = max(1, math.ceil(self.queue_timeout))
+        raise HTTPException(
+            status_code=503,
+            detail=f"{self.name} is overloaded: {reason}",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    async def acquire(self):
+        if not self.semaphore.locked():
+            # A free slot is taken without suspending
+            await self.semaphore.acquire()
+            self.active += 1
+            return
+        if self.waiting >= self.max_queue:
+            self._reject("wait queue is full")
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("timed out waiting for a slot")
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    async def __call__(self):
+        """FastAPI dependency: hold a slot and set the deadline for the request"""
+        await self.acquire()
+        token = None
+        if self.request_timeout:
+            token = request_deadline.set(time.monotonic() + self.request_timeout)
+        try:
+            yield
+        finally:
+            if token is not None:
+                request_deadline.reset(token)
+            self.release()
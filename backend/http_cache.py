@@ -0,0 +1,199 @@
+"""HTTP caching helpers: ETags, conditional GETs, Cache-Control and compression"""
+
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Cache-Control policy per route path template
+CACHE_POLICIES = {
+    "/healthz": "no-store",
+    "/readyz": "no-store",
+    "/api/auth/spotify": "no-store",
+    "/api/auth/spotify/callback": "no-store",
+    "/api/user/{user_id}/profile": "private, no-cache",
+    "/api/user/{user_id}/similar": "private, max-age=60",
+    "/api/user/{user_id}/history": "private, no-cache",
+    "/api/compare/{user1_id}/{user2_id}/trend": "private, max-age=60",
+    "/api/users": "private, no-cache",
+    "/api/compare": "no-store",
+    "/api/scores": "no-store",
+}
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def make_etag(*parts: bytes) -> str:
+    """Weak ETag from content; equal snapshots give equal tags"""
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part)
+        digest.update(b"\0")
+    return f'W/"{digest.hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """True if If-None-Match names this ETag (weak comparison)"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def not_modified(etag: str, cache_control: Optional[str] = None) -> Response:
+    headers = {"ETag": etag}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return Response(status_code=304, headers=headers)
+
+
+class EtagTable:
+    """Per-process user_id -> (etag, expiry) so revalidations skip Spotify and Mongo"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 100_000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # Kept in expiry order: every set moves its key to the end
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        etag, expires_at = entry
+        if expires_at < time.monotonic():
+            self.entries.pop(key, None)
+            return None
+        return etag
+
+    def set(self, key: str, etag: str):
+        now = time.monotonic()
+        self.entries[key] = (etag, now + self.ttl_seconds)
+        self.entries.move_to_end(key)
+        # Expired and excess entries are all at the front
+        while self.entries:
+            _, expires_at = next(iter(self.entries.values()))
+            if expires_at >= now and len(self.entries) <= self.max_entries:
+                break
+            self.entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Encoding -> q value from an Accept-Encoding header"""
+    encodings = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            encodings[name.lower()] = quality
+    return encodings
+
+
+def choose_encoding(header: str, available: Iterable[str]) -> Optional[str]:
+    accepted = parse_accept_encoding(header)
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """Brotli or gzip compression for complete responses above a size threshold"""
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ("br", "gzip") if brotli else ("gzip",)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        header = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        encoding = choose_encoding(header, self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Message] = None
+        chunks = []
+
+        async def send_compressed(message: Message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body"):
+                return
+            body = b"".join(chunks)
+            headers = MutableHeaders(raw=list(start["headers"]))
+            compressible = (
+                len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and headers.get("content-type", "").startswith(COMPRESSIBLE_TYPES)
+            )
+            if compressible:
+                if encoding == "br":
+                    body = brotli.compress(body, quality=self.brotli_quality)
+                else:
+                    body = gzip.compress(body, compresslevel=self.gzip_level)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                headers.add_vary_header("Accept-Encoding")
+            await send({**start, "headers": headers.raw})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
+
+
+class CachePolicyMiddleware:
+    """Apply CACHE_POLICIES by matched route unless a handler set Cache-Control itself"""
+
+    def __init__(self, app: ASGIApp, policies: Dict[str, str] = CACHE_POLICIES):
+        self.app = app
+        self.policies = policies
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_policy(message: Message):
+            if message["type"] == "http.response.start":
+                route = scope.get("route")
+                policy = self.policies.get(getattr(route, "path", None))
+                headers = MutableHeaders(scope=message)
+                if policy and "cache-control" not in headers:
+                    headers["Cache-Control"] = policy
+            await send(message)
+
+        await self.app(scope, receive, send_with_policy)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Import Spotify extended streaming history exports into a user's profile.
+
+Usage:
+    python import_streaming_history.py --user-id <id> Streaming_History_Audio_*.json
+
+Each export file is one large JSON array. Records are parsed one at a time
+from a sliding text buffer, play counts and ms played are aggregated per
+artist and track in bounded memory, and the resulting top lists are written
+to the user's `history_profile` with bulk writes. Progress is checkpointed to
+disk so an interrupted import resumes where it stopped.
+"""
+
+import argparse
+import asyncio
+import codecs
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, InsertOne
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("import_streaming_history")
+
+WHITESPACE = " \t\n\r"
+
+
+class JsonArrayReader:
+    """Yield the elements of a top-level JSON array without loading the file"""
+
+    def __init__(self, fp, offset: int = 0, chunk_size: int = 1 << 20):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.base = offset
+        self.eof = False
+        fp.seek(offset)
+
+    @property
+    def offset(self) -> int:
+        """Byte offset just past the last element yielded"""
+        return self.base + len(self.buffer[:self.pos].encode("utf-8"))
+
+    def _fill(self) -> bool:
+        """Drop consumed text and append the next chunk; False at end of file"""
+        if self.eof:
+            return False
+        self.base = self.offset
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+        chunk = self.fp.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer += self.utf8.decode(chunk, final=self.eof)
+        return not self.eof or bool(self.buffer)
+
+    def __iter__(self) -> Iterator[Dict]:
+        while True:
+            # Skip separators; resuming mid-array lands just after an element
+            while True:
+                while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE + "[,":
+                    self.pos += 1
+                if self.pos < len(self.buffer):
+                    break
+                if not self._fill():
+                    return
+            if self.buffer[self.pos] == "]":
+                self.pos += 1
+                return
+            try:
+                record, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            self.pos = end
+            yield record
+
+
+class BoundedCounter:
+    """Per-key play aggregates that never grow past a fixed number of keys"""
+
+    def __init__(self, capacity: int, entries: Dict = None, pruned: int = 0):
+        self.capacity = capacity
+        self.entries = entries or {}
+        self.pruned = pruned
+
+    def add(self, key: str, ms_played: int, meta: Dict):
+        entry = self.entries.get(key)
+        if entry is None:
+            # Make room first so the new key is never pruned before it is counted
+            if len(self.entries) >= self.capacity:
+                self._prune()
+            entry = self.entries[key] = {"plays": 0, "ms_played": 0, **meta}
+        entry["plays"] += 1
+        entry["ms_played"] += ms_played
+
+    def _prune(self):
+        """Keep the heaviest half; long-tail keys can only re-enter from zero"""
+        keep = heapq.nlargest(self.capacity // 2, self.entries.items(), key=lambda item: item[1]["ms_played"])
+        self.pruned += len(self.entries) - len(keep)
+        self.entries = dict(keep)
+
+    def top(self, limit: int) -> List[Dict]:
+        return heapq.nlargest(limit, self.entries.values(), key=lambda entry: entry["ms_played"])
+
+    def state(self) -> Dict:
+        return {"entries": self.entries, "pruned": self.pruned}
+
+
+def load_checkpoint(path: Path, capacity: int) -> Dict:
+    """Load import state from a checkpoint file, or start fresh"""
+    state = {"files": {}, "records": 0, "skipped": 0, "artists": {}, "tracks": {}}
+    if path.exists():
+        with open(path) as fp:
+            state.update(json.load(fp))
+        logger.info(f"Resuming from checkpoint {path} ({state['records']} records)")
+    state["artists"] = BoundedCounter(capacity, **state["artists"])
+    state["tracks"] = BoundedCounter(capacity, **state["tracks"])
+    return state
+
+
+def save_checkpoint(path: Path, state: Dict):
+    """Atomically write import state so a crash never leaves a torn checkpoint"""
+    data = {**state, "artists": state["artists"].state(), "tracks": state["tracks"].state()}
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w") as fp:
+        json.dump(data, fp)
+    os.replace(tmp_path, path)
+
+
+def process_record(state: Dict, record: Dict, min_ms: int):
+    """Fold one streaming history entry into the aggregates"""
+    track_uri = record.get("spotify_track_uri")
+    ms_played = record.get("ms_played") or 0
+    if not track_uri or ms_played < min_ms:
+        # Podcast episodes, audiobooks and skips do not count as plays
+        state["skipped"] += 1
+        return
+    artist_name = record.get("master_metadata_album_artist_name")
+    track_id = track_uri.rsplit(":", 1)[-1]
+    state["tracks"].add(track_id, ms_played, {
+        "id": track_id,
+        "name": record.get("master_metadata_track_name"),
+        "artists": [{"name": artist_name}] if artist_name else [],
+        "album": {"name": record.get("master_metadata_album_album_name")},
+    })
+    if artist_name:
+        state["artists"].add(artist_name, ms_played, {"id": None, "name": artist_name})
+
+
+def import_files(paths: List[Path], checkpoint_path: Path, capacity: int, min_ms: int,
+                 checkpoint_every: int) -> Dict:
+    """Stream every export file into the aggregates, checkpointing as we go"""
+    state = load_checkpoint(checkpoint_path, capacity)
+    total_bytes = sum(path.stat().st_size for path in paths)
+    done_bytes = sum(state["files"].get(str(path), {}).get("offset", 0) for path in paths)
+    started = time.monotonic()
+    started_bytes = done_bytes
+
+    for path in paths:
+        progress = state["files"].setdefault(str(path), {"offset": 0, "done": False})
+        if progress["done"]:
+            continue
+        logger.info(f"Importing {path.name} from byte {progress['offset']}")
+        with open(path, "rb") as fp:
+            reader = JsonArrayReader(fp, progress["offset"])
+            file_start = progress["offset"]
+            for count, record in enumerate(reader, 1):
+                process_record(state, record, min_ms)
+                state["records"] += 1
+                if count % checkpoint_every == 0:
+                    progress["offset"] = reader.offset
+                    save_checkpoint(checkpoint_path, state)
+                    current = done_bytes + progress["offset"] - file_start
+                    rate = (current - started_bytes) / max(time.monotonic() - started, 1e-6)
+                    eta = (total_bytes - current) / rate if rate else 0
+                    logger.info(
+                        f"{current / total_bytes:6.1%} {state['records']} records, "
+                        f"{rate / 1e6:.1f} MB/s, ETA {eta:.0f}s"
+                    )
+            done_bytes += path.stat().st_size - file_start
+        progress["offset"] = path.stat().st_size
+        progress["done"] = True
+        save_checkpoint(checkpoint_path, state)
+
+    elapsed = time.monotonic() - started
+    logger.info(
+        f"Parsed {state['records']} records ({state['skipped']} skipped) in {elapsed:.1f}s, "
+        f"{state['artists'].pruned + state['tracks'].pruned} long-tail keys pruned"
+    )
+    return state
+
+
+async def write_profile(db, user_id: str, state: Dict, top_limit: int, batch_size: int):
+    """Write top lists into the user document and per-item stats in bulk"""
+    top_artists = state["artists"].top(top_limit)
+    top_tracks = state["tracks"].top(top_limit)
+    history_profile = {
+        "top_artists": top_artists,
+        "top_tracks": top_tracks,
+        "total_plays": sum(entry["plays"] for entry in state["tracks"].entries.values()),
+        "total_ms_played": sum(entry["ms_played"] for entry in state["tracks"].entries.values()),
+        "imported_at": datetime.now(timezone.utc).isoformat()
+    }
+    result = await db.spotify_users.update_one({"id": user_id}, {
+        "$set": {"history_profile": history_profile},
+        "$unset": {"profile_etag": ""}
+    })
+    if not result.matched_count:
+        raise SystemExit(f"User {user_id} not found")
+
+    await db.listening_stats.create_index([("user_id", 1), ("type", 1), ("key", 1)], unique=True)
+    operations = [DeleteMany({"user_id": user_id})]
+    for item_type, counter in (("artist", state["artists"]), ("track", state["tracks"])):
+        for key, entry in counter.entries.items():
+            # Every key is new once the user's old stats are gone, so plain inserts suffice
+            operations.append(InsertOne({
+                "user_id": user_id, "type": item_type, "key": key,
+                "name": entry["name"], "plays": entry["plays"], "ms_played": entry["ms_played"]
+            }))
+    # The delete must land before the first insert batch
+    await db.listening_stats.bulk_write(operations[:1])
+    for start in range(1, len(operations), batch_size):
+        await db.listening_stats.bulk_write(operations[start:start + batch_size], ordered=False)
+    logger.info(f"Wrote {len(operations) - 1} listening stats for user {user_id}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Import Spotify extended streaming history")
+    parser.add_argument("files", nargs="+", type=Path, help="Streaming_History_*.json files")
+    parser.add_argument("--user-id", required=True, help="id of the user in spotify_users")
+    parser.add_argument("--checkpoint", type=Path, help="checkpoint file (default: next to the first export)")
+    parser.add_argument("--capacity", type=int, default=200_000, help="max distinct artists/tracks kept in memory")
+    parser.add_argument("--min-ms", type=int, default=30_000, help="minimum ms_played for a stream to count")
+    parser.add_argument("--top", type=int, default=50, help="number of top artists/tracks stored on the profile")
+    parser.add_argument("--checkpoint-every", type=int, default=200_000, help="records between checkpoints")
+    parser.add_argument("--batch-size", type=int, default=1000, help="operations per bulk_write")
+    args = parser.parse_args()
+
+    paths = sorted(args.files)
+    checkpoint_path = args.checkpoint or paths[0].parent / f".import_{args.user_id}.checkpoint.json"
+    state = import_files(paths, checkpoint_path, args.capacity, args.min_ms, args.checkpoint_every)
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        await write_profile(client[os.environ['DB_NAME']], args.user_id, state, args.top, args.batch_size)
+    finally:
+        client.close()
+    checkpoint_path.unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,212 @@
+"""Compact storage format for profile snapshots.
+
+A verbose snapshot repeats the full Spotify JSON of 20 artists and 20 tracks
+in every user document. The compact format (schema version 2) replaces that
+with:
+
+- interned item ids: every artist, track and genre is stored once in
+  `spotify_items` and referenced by a small integer id
+- ranked id lists packed as little-endian uint32 arrays in BSON Binary
+- the averaged audio-feature vector packed as float32 in BSON Binary
+
+Decoding is lazy: `CompactProfile` exposes the packed arrays as memoryviews
+over the bytes returned by the driver, so nothing is copied until a caller
+asks for a Python structure.
+"""
+
+import struct
+import sys
+from array import array
+from datetime import datetime, timezone
+from functools import cached_property
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from bson.binary import Binary
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+SCHEMA_VERSION = 2
+
+AUDIO_FEATURES = ['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo']
+FEATURES_FORMAT = f"<{len(AUDIO_FEATURES)}f"
+
+LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+def pack_ids(ids: Iterable[int]) -> Binary:
+    """Pack ranked interned ids as little-endian uint32"""
+    packed = array("I", ids)
+    if not LITTLE_ENDIAN:
+        packed.byteswap()
+    return Binary(packed.tobytes())
+
+
+def unpack_ids(data: bytes):
+    """View packed ids without copying (copies only on big-endian hosts)"""
+    if LITTLE_ENDIAN:
+        return memoryview(data).cast("I")
+    unpacked = array("I", data)
+    unpacked.byteswap()
+    return unpacked
+
+
+def pack_features(audio_features: Dict[str, float]) -> Binary:
+    """Pack the averaged audio features in AUDIO_FEATURES order as float32"""
+    return Binary(struct.pack(FEATURES_FORMAT, *(audio_features.get(feature, 0) for feature in AUDIO_FEATURES)))
+
+
+def unpack_features(data: bytes) -> Dict[str, float]:
+    """Decode a packed feature vector; an empty blob means no features"""
+    if not data:
+        return {}
+    return dict(zip(AUDIO_FEATURES, struct.unpack(FEATURES_FORMAT, data)))
+
+
+def slim_item(kind: str, item) -> Dict:
+    """Metadata kept once per interned item"""
+    if kind == "genre":
+        return {"name": item}
+    images = item.get("images") or []
+    slim = {"id": item["id"], "name": item.get("name"), "images": images[:1]}
+    if kind == "artist":
+        slim["genres"] = item.get("genres", [])
+    elif kind == "track":
+        album = item.get("album") or {}
+        slim["artists"] = [{"id": artist.get("id"), "name": artist.get("name")} for artist in item.get("artists", [])]
+        slim["album"] = {"name": album.get("name"), "images": (album.get("images") or [])[:1]}
+    return slim
+
+
+class ItemInterner:
+    """Maps Spotify artist/track/genre keys to small integer ids stored in `spotify_items`"""
+
+    def __init__(self, db):
+        self.db = db
+        self.ids: Dict[str, int] = {}
+        self.meta: Dict[int, Dict] = {}
+
+    async def ensure_indexes(self):
+        await self.db.spotify_items.create_index("key", unique=True)
+
+    async def intern(self, kind: str, items: List) -> List[int]:
+        """Return interned ids for items, allocating ids for unseen ones"""
+        keyed: Dict[str, Dict] = {}
+        keys = []
+        for item in items:
+            key = f"{kind}:{item if kind == 'genre' else item['id']}"
+            keys.append(key)
+            if key not in self.ids and key not in keyed:
+                keyed[key] = slim_item(kind, item)
+
+        if keyed:
+            await self._load_keys(list(keyed))
+            new_keys = [key for key in keyed if key not in self.ids]
+            if new_keys:
+                counter = await self.db.counters.find_one_and_update(
+                    {"_id": "spotify_items"},
+                    {"$inc": {"seq": len(new_keys)}},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                first_id = counter["seq"] - len(new_keys) + 1
+                operations = [
+                    UpdateOne({"key": key}, {"$setOnInsert": {"_id": first_id + i, "meta": keyed[key]}}, upsert=True)
+                    for i, key in enumerate(new_keys)
+                ]
+                try:
+                    await self.db.spotify_items.bulk_write(operations, ordered=False)
+                except BulkWriteError:
+                    # Another writer interned some of these keys first; its ids win
+                    pass
+                await self._load_keys(new_keys)
+
+        return [self.ids[key] for key in keys]
+
+    async def _load_keys(self, keys: List[str]):
+        async for doc in self.db.spotify_items.find({"key": {"$in": keys}}):
+            self.ids[doc["key"]] = doc["_id"]
+            self.meta[doc["_id"]] = doc["meta"]
+
+    async def lookup(self, item_ids: Iterable[int]) -> List[Dict]:
+        """Return stored metadata for interned ids, in order"""
+        item_ids = list(item_ids)
+        missing = [item_id for item_id in set(item_ids) if item_id not in self.meta]
+        if missing:
+            async for doc in self.db.spotify_items.find({"_id": {"$in": missing}}):
+                self.ids[doc["key"]] = doc["_id"]
+                self.meta[doc["_id"]] = doc["meta"]
+        return [self.meta.get(item_id, {}) for item_id in item_ids]
+
+
+async def encode_profile(interner: ItemInterner, top_artists: List[Dict], top_tracks: List[Dict],
+                         genres: List[str], audio_features: Dict[str, float],
+                         updated_at: Optional[datetime] = None) -> Dict:
+    """Build a compact profile snapshot document"""
+    return encode_snapshot(
+        await interner.intern("artist", top_artists),
+        await interner.intern("track", top_tracks),
+        await interner.intern("genre", genres),
+        audio_features,
+        updated_at
+    )
+
+
+def encode_snapshot(artist_ids: List[int], track_ids: List[int], genre_ids: List[int],
+                    audio_features: Dict[str, float], updated_at: Optional[datetime] = None) -> Dict:
+    """Pack already-interned ids and features into a snapshot document"""
+    return {
+        "v": SCHEMA_VERSION,
+        "a": pack_ids(artist_ids),
+        "t": pack_ids(track_ids),
+        "g": pack_ids(genre_ids),
+        "f": pack_features(audio_features) if audio_features else Binary(b""),
+        "u": updated_at or datetime.now(timezone.utc),
+    }
+
+
+class CompactProfile:
+    """Lazy read-only view over a compact snapshot document"""
+
+    def __init__(self, doc: Dict):
+        self.doc = doc
+
+    @cached_property
+    def artist_ids(self):
+        return unpack_ids(self.doc["a"])
+
+    @cached_property
+    def track_ids(self):
+        return unpack_ids(self.doc["t"])
+
+    @cached_property
+    def genre_ids(self):
+        return unpack_ids(self.doc["g"])
+
+    @cached_property
+    def audio_features(self) -> Dict[str, float]:
+        return unpack_features(self.doc["f"])
+
+    @property
+    def updated_at(self) -> Optional[datetime]:
+        return self.doc.get("u")
+
+    def similarity_input(self) -> Dict:
+        """Shape expected by calculate_similarity, keyed by interned ids"""
+        return {
+            "top_artists": [{"id": item_id} for item_id in self.artist_ids],
+            "top_tracks": [{"id": item_id} for item_id in self.track_ids],
+            "genres": list(self.genre_ids),
+            "audio_features": self.audio_features,
+        }
+
+
+def is_compact(snapshot: Optional[Dict]) -> bool:
+    return bool(snapshot) and snapshot.get("v") == SCHEMA_VERSION
+
+
+async def snapshot_items(interner: ItemInterner, snapshot: Dict) -> Tuple[List[Dict], List[Dict]]:
+    """Top artist and track dicts from a snapshot in either storage format"""
+    if not is_compact(snapshot):
+        return snapshot.get("top_artists", []), snapshot.get("top_tracks", [])
+    profile = CompactProfile(snapshot)
+    return await interner.lookup(profile.artist_ids), await interner.lookup(profile.track_ids)
@@ -0,0 +1,184 @@
+"""Versioned profile history stored as keyframes plus deltas.
+
+Every profile refresh that changes a user's top artists, tracks, genres or
+audio features appends one `profile_history` entry. Every KEYFRAME_INTERVAL
+versions the entry is a keyframe holding the full compact sets; in between it
+is a delta listing the interned ids that entered (`+`) or left (`-`) each set
+and the new feature vector if it moved. A state is rebuilt from the nearest
+keyframe plus at most KEYFRAME_INTERVAL - 1 deltas.
+
+Trends walk two users' timelines in time order and keep the shared artist,
+track and genre counts up to date from each delta, so each point costs only
+the size of the change rather than a full recomputation.
+"""
+
+import heapq
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Set
+
+from profile_codec import CompactProfile, is_compact, pack_ids, unpack_features, unpack_ids
+from similarity import similarity_components, weight_vector, weighted_score
+
+KEYFRAME_INTERVAL = 10
+
+SETS = {"a": "artists", "t": "tracks", "g": "genres"}
+
+
+def naive_utc(value: datetime) -> datetime:
+    """Mongo hands back naive UTC datetimes; compare like with like"""
+    if value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def diff_snapshots(previous: Optional[Dict], snapshot: Dict) -> Optional[Dict]:
+    """Delta fields between two compact snapshots, None if nothing changed"""
+    new = CompactProfile(snapshot)
+    if not is_compact(previous):
+        return {"full": True}
+    old = CompactProfile(previous)
+
+    delta = {}
+    for field in SETS:
+        old_ids, new_ids = set(unpack_ids(previous[field])), set(unpack_ids(snapshot[field]))
+        if new_ids - old_ids:
+            delta[f"{field}+"] = pack_ids(sorted(new_ids - old_ids))
+        if old_ids - new_ids:
+            delta[f"{field}-"] = pack_ids(sorted(old_ids - new_ids))
+    if old.audio_features != new.audio_features:
+        delta["f"] = snapshot["f"]
+    return delta or None
+
+
+def history_entry(user_id: str, seq: int, delta: Dict, snapshot: Dict) -> Dict:
+    """Build the profile_history document for a new version"""
+    entry = {"user_id": user_id, "seq": seq, "at": snapshot["u"]}
+    if delta.get("full") or seq % KEYFRAME_INTERVAL == 1:
+        entry["key"] = True
+        entry.update({field: snapshot[field] for field in (*SETS, "f")})
+    else:
+        entry["key"] = False
+        entry.update(delta)
+    return entry
+
+
+class ProfileState:
+    """Sets and features of one user at one point in history"""
+
+    def __init__(self):
+        self.sets: Dict[str, Set[int]] = {field: set() for field in SETS}
+        self.features: Dict[str, float] = {}
+
+    def apply(self, entry: Dict) -> Dict[str, tuple]:
+        """Apply an entry; returns per set field the (added, removed) ids"""
+        changes = {}
+        for field in SETS:
+            if entry["key"]:
+                new_ids = set(unpack_ids(entry[field]))
+                added, removed = new_ids - self.sets[field], self.sets[field] - new_ids
+            else:
+                added = set(unpack_ids(entry.get(f"{field}+", b"")))
+                removed = set(unpack_ids(entry.get(f"{field}-", b"")))
+            self.sets[field] -= removed
+            self.sets[field] |= added
+            changes[field] = (added, removed)
+        if "f" in entry:
+            self.features = unpack_features(entry["f"])
+        return changes
+
+    def to_snapshot(self) -> Dict:
+        return {
+            "top_artist_ids": sorted(self.sets["a"]),
+            "top_track_ids": sorted(self.sets["t"]),
+            "genre_ids": sorted(self.sets["g"]),
+            "audio_features": self.features,
+        }
+
+
+async def load_timeline(db, user_id: str, since: Optional[datetime] = None,
+                        until: Optional[datetime] = None) -> List[Dict]:
+    """History entries from the last keyframe at or before `since` onwards, up to `until`"""
+    query = {"user_id": user_id}
+    if until is not None:
+        query["at"] = {"$lte": naive_utc(until)}
+    if since is not None:
+        since = naive_utc(since)
+        keyframe = await db.profile_history.find_one(
+            {"user_id": user_id, "key": True, "at": {"$lte": since}},
+            {"seq": 1},
+            sort=[("seq", -1)]
+        )
+        if keyframe:
+            query["seq"] = {"$gte": keyframe["seq"]}
+    return await db.profile_history.find(query, {"_id": 0}).sort("seq", 1).to_list(None)
+
+
+async def reconstruct(db, user_id: str, at: datetime) -> Optional[Dict]:
+    """A user's profile sets and features as of a point in time"""
+    entries = await load_timeline(db, user_id, since=at, until=at)
+    state = None
+    for entry in entries:
+        if state is None and not entry["key"]:
+            continue
+        state = state or ProfileState()
+        state.apply(entry)
+    return state.to_snapshot() if state else None
+
+
+class PairTracker:
+    """Shared-item counts between two evolving profiles, maintained from deltas"""
+
+    def __init__(self):
+        self.states = (ProfileState(), ProfileState())
+        self.shared = {field: 0 for field in SETS}
+        self.started = [False, False]
+
+    def apply(self, side: int, entry: Dict):
+        if not self.started[side]:
+            # Deltas mean nothing until this side has seen a keyframe
+            if not entry["key"]:
+                return
+            self.started[side] = True
+        mine, other = self.states[side], self.states[1 - side]
+        changes = mine.apply(entry)
+        for field, (added, removed) in changes.items():
+            other_ids = other.sets[field]
+            self.shared[field] += len(added & other_ids) - len(removed & other_ids)
+
+    @property
+    def ready(self) -> bool:
+        return all(self.started)
+
+    def components(self) -> Dict[str, float]:
+        """Same components as calculate_similarity, from the tracked counts"""
+        user1, user2 = self.states
+        return similarity_components(
+            self.shared["a"], len(user1.sets["a"]),
+            self.shared["t"], len(user1.sets["t"]),
+            self.shared["g"], len(user1.sets["g"]) + len(user2.sets["g"]) - self.shared["g"],
+            user1.features, user2.features
+        )
+
+
+def similarity_trend(timeline1: List[Dict], timeline2: List[Dict],
+                     weights: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """Similarity after every change of either profile, oldest first"""
+    vector = weight_vector(weights)
+    tracker = PairTracker()
+    events = heapq.merge(
+        ((entry["at"], 0, entry) for entry in timeline1),
+        ((entry["at"], 1, entry) for entry in timeline2),
+        key=lambda event: (event[0], event[1])
+    )
+    points = []
+    for at, side, entry in events:
+        tracker.apply(side, entry)
+        if not tracker.ready:
+            continue
+        components = tracker.components()
+        point = {"at": at, "similarity_score": weighted_score(components, vector), "components": components}
+        if points and points[-1]["at"] == at:
+            points[-1] = point
+        else:
+            points.append(point)
+    return points
@@ -0,0 +1,153 @@
+"""Item-based collaborative recommendations over a sparse user x item matrix.
+
+Every stored profile contributes one sparse row: its top artists and top
+tracks, weighted by rank. Item-item co-occurrence sums and item norms are
+kept up to date incrementally whenever a single profile changes, so a query
+only walks the neighbours of the querying user's own items and never rescans
+the user base.
+"""
+
+import heapq
+import math
+from typing import Dict, List, Optional
+
+
+def item_key(item_type: str, item_id: str) -> str:
+    """Build the matrix column key for an artist or track"""
+    return f"{item_type}:{item_id}"
+
+
+def rank_weight(rank: int) -> float:
+    """Weight of an item at a 0-based rank in a top list"""
+    return 1.0 / math.log2(rank + 2)
+
+
+def profile_vector(top_artists: List[Dict], top_tracks: List[Dict]) -> Dict[str, float]:
+    """Turn top artist/track lists into a sparse weighted row"""
+    vector = {}
+    for item_type, items in (("artist", top_artists), ("track", top_tracks)):
+        for rank, item in enumerate(items):
+            if item.get("id") is None:
+                continue
+            key = item_key(item_type, item["id"])
+            vector[key] = max(vector.get(key, 0.0), rank_weight(rank))
+    return vector
+
+
+def item_summary(item_type: str, item: Dict) -> Dict:
+    """Keep only what the API returns for a recommended item"""
+    images = item.get("images") or (item.get("album") or {}).get("images") or []
+    summary = {
+        "id": item["id"],
+        "type": item_type,
+        "name": item.get("name"),
+        "image": images[0]["url"] if images else None,
+    }
+    if item_type == "track":
+        summary["artists"] = [artist.get("name") for artist in item.get("artists", [])]
+    return summary
+
+
+class CooccurrenceRecommender:
+    """Sparse user x item matrix with incrementally maintained item-item similarity"""
+
+    def __init__(self):
+        self.user_vectors: Dict[str, Dict[str, float]] = {}
+        self.item_users: Dict[str, Dict[str, float]] = {}
+        self.item_norms: Dict[str, float] = {}
+        self.cooccurrence: Dict[str, Dict[str, float]] = {}
+        self.item_meta: Dict[str, Dict] = {}
+
+    def __len__(self):
+        return len(self.user_vectors)
+
+    def _apply(self, user_id: str, vector: Dict[str, float], sign: float):
+        """Add (sign=1) or remove (sign=-1) one user's row from the matrix"""
+        items = list(vector.items())
+        for i, (item_a, weight_a) in enumerate(items):
+            self.item_norms[item_a] = self.item_norms.get(item_a, 0.0) + sign * weight_a * weight_a
+            users = self.item_users.setdefault(item_a, {})
+            if sign > 0:
+                users[user_id] = weight_a
+            else:
+                users.pop(user_id, None)
+            for item_b, weight_b in items[i + 1:]:
+                delta = sign * weight_a * weight_b
+                row_a = self.cooccurrence.setdefault(item_a, {})
+                row_b = self.cooccurrence.setdefault(item_b, {})
+                value = row_a.get(item_b, 0.0) + delta
+                if value > 1e-9:
+                    row_a[item_b] = value
+                    row_b[item_a] = value
+                else:
+                    row_a.pop(item_b, None)
+                    row_b.pop(item_a, None)
+            if not users:
+                # Last listener gone - drop the column entirely
+                self.item_users.pop(item_a, None)
+                self.item_norms.pop(item_a, None)
+                self.cooccurrence.pop(item_a, None)
+                self.item_meta.pop(item_a, None)
+
+    def update_user(self, user_id: str, top_artists: List[Dict], top_tracks: List[Dict]):
+        """Replace a user's row, updating only the affected similarities"""
+        vector = profile_vector(top_artists, top_tracks)
+        previous = self.user_vectors.get(user_id)
+        if previous == vector:
+            return
+        if previous:
+            self._apply(user_id, previous, -1.0)
+        for item_type, items in (("artist", top_artists), ("track", top_tracks)):
+            for item in items:
+                if item.get("id") is not None:
+                    self.item_meta[item_key(item_type, item["id"])] = item_summary(item_type, item)
+        self.user_vectors[user_id] = vector
+        self._apply(user_id, vector, 1.0)
+
+    def remove_user(self, user_id: str):
+        """Drop a user's row from the matrix"""
+        previous = self.user_vectors.pop(user_id, None)
+        if previous:
+            self._apply(user_id, previous, -1.0)
+
+    def similarity(self, item_a: str, item_b: str) -> float:
+        """Cosine similarity between two item columns"""
+        shared = self.cooccurrence.get(item_a, {}).get(item_b, 0.0)
+        if not shared:
+            return 0.0
+        return shared / math.sqrt(self.item_norms[item_a] * self.item_norms[item_b])
+
+    def recommend(self, user_id: str, limit: int = 10, item_type: Optional[str] = None,
+                  boost_user_id: Optional[str] = None, boost: float = 0.5) -> List[Dict]:
+        """Recommend unseen items for a user, optionally favouring another user's items"""
+        vector = self.user_vectors.get(user_id)
+        if not vector:
+            return []
+
+        scores: Dict[str, float] = {}
+        for item_a, weight_a in vector.items():
+            norm_a = self.item_norms.get(item_a)
+            if not norm_a:
+                continue
+            for item_b, shared in self.cooccurrence.get(item_a, {}).items():
+                if item_b in vector:
+                    continue
+                scores[item_b] = scores.get(item_b, 0.0) + weight_a * shared / math.sqrt(norm_a * self.item_norms[item_b])
+
+        # Items the comparison partner listens to get a prior so the two users
+        # see what they could share next, even in a small user base
+        partner = self.user_vectors.get(boost_user_id) if boost_user_id else None
+        if partner:
+            for item_b, weight_b in partner.items():
+                if item_b not in vector:
+                    scores[item_b] = scores.get(item_b, 0.0) + boost * weight_b
+
+        if item_type:
+            prefix = f"{item_type}:"
+            scores = {key: score for key, score in scores.items() if key.startswith(prefix)}
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda entry: entry[1])
+        return [
+            {**self.item_meta.get(key, {"id": key.split(":", 1)[1], "type": key.split(":", 1)[0]}), "score": round(score, 4)}
+            for key, score in best
+        ]
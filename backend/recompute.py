@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Offline bulk recompute of profile snapshots and cached pair scores.
+
+Usage:
+    python recompute.py snapshots     # re-encode stored snapshots to the current schema
+    python recompute.py scores        # rescore every cached pair in `comparisons`
+
+Users and comparisons are streamed with a cursor in _id order. Scoring is
+sharded across a process pool, results are written back with unordered
+bulk_write batches, and the last written _id is checkpointed in
+`recompute_checkpoints` so a rerun resumes after a crash.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from profile_codec import CompactProfile, ItemInterner, encode_profile, is_compact
+from similarity import SCORING_VERSION, calculate_similarity, pack_components
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("recompute")
+
+
+def score_pairs(pairs: List[Tuple[object, Dict, Dict]]) -> List[Tuple[object, float, bytes]]:
+    """Pool worker: score (comparison id, snapshot1, snapshot2) triples"""
+    results = []
+    for comparison_id, snapshot1, snapshot2 in pairs:
+        comparison = calculate_similarity(
+            CompactProfile(snapshot1).similarity_input(),
+            CompactProfile(snapshot2).similarity_input()
+        )
+        results.append((comparison_id, comparison['similarity_score'], pack_components(comparison['components'])))
+    return results
+
+
+def legacy_updated_at(snapshot: Dict) -> Optional[datetime]:
+    """When a verbose snapshot was taken; prepare_for_mongo stored it as an ISO string"""
+    value = snapshot.get("updated_at")
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+class Checkpoint:
+    """Last processed _id of a job, stored next to the data it describes"""
+
+    def __init__(self, db, job: str):
+        self.db = db
+        self.job = job
+
+    async def load(self) -> Dict:
+        return await self.db.recompute_checkpoints.find_one({"_id": self.job}) or {"last_id": None, "processed": 0}
+
+    async def save(self, last_id, processed: int):
+        await self.db.recompute_checkpoints.update_one(
+            {"_id": self.job},
+            {"$set": {"last_id": last_id, "processed": processed, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    async def clear(self):
+        await self.db.recompute_checkpoints.delete_one({"_id": self.job})
+
+
+async def stream_batches(collection, query: Dict, projection: Dict, last_id, batch_size: int):
+    """Yield documents in _id order after last_id, batch by batch"""
+    if last_id is not None:
+        query = {**query, "_id": {"$gt": last_id}}
+    cursor = collection.find(query, projection).sort("_id", 1).batch_size(batch_size)
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Throughput:
+    """Running rate reporter"""
+
+    def __init__(self, label: str, already_done: int):
+        self.label = label
+        self.done = already_done
+        self.session = 0
+        self.started = time.monotonic()
+
+    def add(self, count: int):
+        self.done += count
+        self.session += count
+        elapsed = time.monotonic() - self.started
+        logger.info(f"{self.label}: {self.done} processed, {self.session / max(elapsed, 1e-6):.0f}/s")
+
+
+async def recompute_snapshots(db, args):
+    """Re-encode legacy verbose snapshots into the compact schema"""
+    interner = ItemInterner(db)
+    await interner.ensure_indexes()
+    checkpoint = Checkpoint(db, "snapshots")
+    state = await checkpoint.load()
+    throughput = Throughput("snapshots", state["processed"])
+
+    async for batch in stream_batches(
+        db.spotify_users, {"profile_snapshot": {"$exists": True}}, {"profile_snapshot": 1},
+        state["last_id"], args.batch_size
+    ):
+        operations = []
+        for user_doc in batch:
+            snapshot = user_doc["profile_snapshot"]
+            if is_compact(snapshot):
+                continue
+            compact = await encode_profile(
+                interner,
+                snapshot.get("top_artists", []),
+                snapshot.get("top_tracks", []),
+                snapshot.get("genres", []),
+                snapshot.get("audio_features", {}),
+                legacy_updated_at(snapshot)
+            )
+            operations.append(UpdateOne({"_id": user_doc["_id"]}, {"$set": {"profile_snapshot": compact}}))
+        if operations:
+            await db.spotify_users.bulk_write(operations, ordered=False)
+        throughput.add(len(batch))
+        await checkpoint.save(batch[-1]["_id"], throughput.done)
+    await checkpoint.clear()
+
+
+async def recompute_scores(db, args):
+    """Rescore cached pairs from stored snapshots on a process pool"""
+    checkpoint = Checkpoint(db, "scores")
+    state = await checkpoint.load()
+    throughput = Throughput("scores", state["processed"])
+    query = {} if args.all else {"scoring_version": {"$ne": SCORING_VERSION}}
+    loop = asyncio.get_running_loop()
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        async for batch in stream_batches(
+            db.comparisons, query, {"user1_id": 1, "user2_id": 1},
+            state["last_id"], args.batch_size
+        ):
+            user_ids = {doc["user1_id"] for doc in batch} | {doc["user2_id"] for doc in batch}
+            snapshots = {}
+            async for user_doc in db.spotify_users.find({"id": {"$in": list(user_ids)}}, {"id": 1, "profile_snapshot": 1}):
+                if is_compact(user_doc.get("profile_snapshot")):
+                    snapshots[user_doc["id"]] = user_doc["profile_snapshot"]
+
+            pairs = [
+                (doc["_id"], snapshots[doc["user1_id"]], snapshots[doc["user2_id"]])
+                for doc in batch
+                if doc["user1_id"] in snapshots and doc["user2_id"] in snapshots
+            ]
+            shard_size = max(len(pairs) // args.workers, 1)
+            shards = [pairs[i:i + shard_size] for i in range(0, len(pairs), shard_size)]
+            results = await asyncio.gather(*(loop.run_in_executor(pool, score_pairs, shard) for shard in shards))
+
+            computed_at = datetime.now(timezone.utc)
+            operations = [
+                UpdateOne({"_id": comparison_id}, {"$set": {
+                    "similarity_score": score,
+                    "components": components,
+                    "scoring_version": SCORING_VERSION,
+                    "computed_at": computed_at
+                }})
+                for shard in results
+                for comparison_id, score, components in shard
+            ]
+            if operations:
+                await db.comparisons.bulk_write(operations, ordered=False)
+            if len(pairs) < len(batch):
+                logger.warning(f"Skipped {len(batch) - len(pairs)} pairs without a compact snapshot")
+            throughput.add(len(batch))
+            await checkpoint.save(batch[-1]["_id"], throughput.done)
+    await checkpoint.clear()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recompute profile snapshots and cached pair scores")
+    parser.add_argument("job", choices=["snapshots", "scores"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="scoring processes")
+    parser.add_argument("--batch-size", type=int, default=5000, help="documents per cursor batch and bulk_write")
+    parser.add_argument("--all", action="store_true", help="rescore pairs already at the current scoring version")
+    parser.add_argument("--restart", action="store_true", help="ignore any saved checkpoint")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.restart:
+            await Checkpoint(db, args.job).clear()
+        if args.job == "snapshots":
+            await recompute_snapshots(db, args)
+        else:
+            await recompute_scores(db, args)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,36 +1,167 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Query
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, Query
+from fastapi.responses import JSONResponse, RedirectResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import httpx
 import base64
 import json
 from urllib.parse import urlencode, parse_qs
 import secrets
+import asyncio
+import numpy as np
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+from admission import AdmissionController, DeadlineExceeded, outbound_timeout
+from http_cache import CachePolicyMiddleware, CompressionMiddleware, EtagTable, etag_matches, make_etag, not_modified
+from profile_history import diff_snapshots, history_entry, load_timeline, naive_utc, reconstruct, similarity_trend
+from profile_codec import CompactProfile, ItemInterner, encode_profile, is_compact, snapshot_items
+from recommendations import CooccurrenceRecommender
+from similarity import SCORING_VERSION, calculate_similarity, pack_components, score_matrix, unpack_components, weight_vector
+from vector_store import SharedVectorStore, WriterLock, write_store
+from write_behind import WriteBehindBuffer
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+class LazyDatabase:
+    """MongoDB handle whose Motor client is created on first use, not at import"""
+    
+    def __init__(self):
+        self._client = None
+        self._db = None
+    
+    def _database(self):
+        if self._db is None:
+            self._client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+            self._db = self._client[os.environ['DB_NAME']]
+        return self._db
+    
+    def __getattr__(self, name):
+        return getattr(self._database(), name)
+    
+    def __getitem__(self, name):
+        return self._database()[name]
+    
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+        self._client = None
+        self._db = None
+
 # MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+db = LazyDatabase()
+
+@lru_cache(maxsize=None)
+def spotify_config() -> Dict[str, str]:
+    """Spotify credentials, read from the environment on first use"""
+    return {
+        "client_id": os.environ['SPOTIFY_CLIENT_ID'],
+        "client_secret": os.environ['SPOTIFY_CLIENT_SECRET'],
+        "redirect_uri": os.environ['SPOTIFY_REDIRECT_URI']
+    }
+
+# Shared Spotify HTTP client with connection pooling, created on first use
+spotify_http_client: Optional[httpx.AsyncClient] = None
+
+def spotify_http() -> httpx.AsyncClient:
+    global spotify_http_client
+    if spotify_http_client is None:
+        spotify_http_client = httpx.AsyncClient()
+    return spotify_http_client
+
+# Interned ids for compact profile snapshots
+interner = ItemInterner(db)
+
+# In-process item-item recommender, fed from stored profile snapshots and
+# re-synced periodically so every worker sees profiles refreshed by the others.
+# Rows are keyed by spotify_id, which (unlike `id`) survives a re-login.
+RECOMMENDER_SYNC_SECONDS = int(os.environ.get('RECOMMENDER_SYNC_SECONDS', '60'))
+RECOMMENDER_HISTORY_TRACKS = int(os.environ.get('RECOMMENDER_HISTORY_TRACKS', '20'))
+RECOMMENDER_SYNC_OVERLAP = timedelta(seconds=RECOMMENDER_SYNC_SECONDS)
+recommender = CooccurrenceRecommender()
+recommender_synced_at: Optional[datetime] = None
 
-# Spotify config
-SPOTIFY_CLIENT_ID = os.environ['SPOTIFY_CLIENT_ID']
-SPOTIFY_CLIENT_SECRET = os.environ['SPOTIFY_CLIENT_SECRET']
-SPOTIFY_REDIRECT_URI = os.environ['SPOTIFY_REDIRECT_URI']
+# Memory-mapped profile vectors shared by all workers; one worker rebuilds it
+VECTOR_STORE_PATH = Path(os.environ.get('VECTOR_STORE_PATH', ROOT_DIR / 'data' / 'profile_vectors.bin'))
+VECTOR_STORE_REFRESH_SECONDS = int(os.environ.get('VECTOR_STORE_REFRESH_SECONDS', '300'))
+VECTOR_STORE_LOCK_RETRY_SECONDS = int(os.environ.get('VECTOR_STORE_LOCK_RETRY_SECONDS', '30'))
+vector_store = SharedVectorStore(VECTOR_STORE_PATH)
+vector_store_lock = WriterLock(VECTOR_STORE_PATH)
+
+# ETags of the latest profile snapshot per user, for conditional GETs
+PROFILE_ETAG_TTL_SECONDS = int(os.environ.get('PROFILE_ETAG_TTL_SECONDS', '300'))
+PROFILE_ETAG_MAX_ENTRIES = int(os.environ.get('PROFILE_ETAG_MAX_ENTRIES', '100000'))
+profile_etags = EtagTable(PROFILE_ETAG_TTL_SECONDS, PROFILE_ETAG_MAX_ENTRIES)
+
+# Admission control for /api/compare, which fans out to several Spotify calls
+SPOTIFY_TIMEOUT_SECONDS = float(os.environ.get('SPOTIFY_TIMEOUT_SECONDS', '5'))
+compare_admission = AdmissionController(
+    "compare",
+    max_concurrency=int(os.environ.get('COMPARE_MAX_CONCURRENCY', '32')),
+    max_queue=int(os.environ.get('COMPARE_MAX_QUEUE', '64')),
+    queue_timeout=float(os.environ.get('COMPARE_QUEUE_TIMEOUT_SECONDS', '2')),
+    request_timeout=float(os.environ.get('COMPARE_DEADLINE_SECONDS', '10'))
+)
+
+# Non-critical writes (cached comparisons) are batched off the request path
+write_buffer = WriteBehindBuffer(
+    db,
+    max_batch=int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', '500')),
+    flush_interval=float(os.environ.get('WRITE_BEHIND_FLUSH_SECONDS', '0.5')),
+    max_pending=int(os.environ.get('WRITE_BEHIND_MAX_PENDING', '10000'))
+)
+
+# Conditional snapshot writes retried when concurrent refreshes of one user race
+SNAPSHOT_WRITE_ATTEMPTS = 5
+
+# Profile history older than this cannot gain versions and may be cached
+HISTORY_SETTLED_AFTER = timedelta(minutes=1)
+
+# /api/scores rescoring: cursor batch size and the cap on an unfiltered scan
+SCORES_BATCH_SIZE = int(os.environ.get('SCORES_BATCH_SIZE', '10000'))
+SCORES_MAX_SCAN = int(os.environ.get('SCORES_MAX_SCAN', '200000'))
+
+# Background warm-up before the worker reports ready
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+WARMUP_PROFILES = int(os.environ.get('WARMUP_PROFILES', '500'))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services without blocking startup; stop them cleanly"""
+    app.state.ready = False
+    app.state.indexes = "building"
+    write_buffer.start()
+    app.state.vector_store_writer = asyncio.create_task(claim_vector_store_writer())
+    app.state.index_builder = asyncio.create_task(build_indexes(app))
+    app.state.warmup = asyncio.create_task(warm_up(app, preload=WARMUP_ENABLED))
+    app.state.recommender_sync = asyncio.create_task(refresh_recommender())
+    
+    yield
+    
+    app.state.ready = False
+    app.state.index_builder.cancel()
+    app.state.warmup.cancel()
+    app.state.recommender_sync.cancel()
+    app.state.vector_store_writer.cancel()
+    vector_store_lock.release()
+    await write_buffer.close()
+    if spotify_http_client is not None:
+        await spotify_http_client.aclose()
+    db.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -55,6 +186,8 @@ class UserProfile(BaseModel):
     top_tracks: List[Dict[str, Any]] = []
     audio_features: Dict[str, float] = {}
     genres: List[str] = []
+    history_top_artists: List[Dict[str, Any]] = []
+    history_top_tracks: List[Dict[str, Any]] = []
 
 class ComparisonResult(BaseModel):
     user1: UserProfile
@@ -65,6 +198,15 @@ class ComparisonResult(BaseModel):
     shared_genres: List[str] = []
     audio_features_comparison: Dict[str, Dict[str, float]] = {}
     recommendations: List[str] = []
+    recommended_for_user1: List[Dict[str, Any]] = []
+    recommended_for_user2: List[Dict[str, Any]] = []
+    score_components: Dict[str, float] = {}
+
+class ScoreQuery(BaseModel):
+    weights: Dict[str, float] = {}
+    user_id: Optional[str] = None
+    other_user_id: Optional[str] = None
+    limit: int = Field(20, ge=1, le=1000)
 
 # Helper functions
 def prepare_for_mongo(data):
@@ -92,11 +234,69 @@ def parse_from_mongo(item):
                 item[key] = [parse_from_mongo(subitem) if isinstance(subitem, dict) else subitem for subitem in value]
     return item
 
+def recommender_tracks(user_doc: Dict, top_tracks: List[Dict]) -> List[Dict]:
+    """API top tracks followed by the top tracks of an imported streaming history
+    
+    Imported tracks carry Spotify ids, so they extend the user's recommender
+    row past the 20 items the API returns, up to RECOMMENDER_HISTORY_TRACKS
+    more. Imported artists are keyed by name only and are skipped by the
+    recommender.
+    """
+    seen = {track.get("id") for track in top_tracks}
+    history = user_doc.get("history_profile", {}).get("top_tracks", [])
+    return top_tracks + [track for track in history if track.get("id") not in seen][:RECOMMENDER_HISTORY_TRACKS]
+
+def profile_response_etag(user_doc: Dict, snapshot: Dict, top_artists: List[Dict], top_tracks: List[Dict]) -> str:
+    """ETag of a profile response, covering everything its body is built from"""
+    return make_etag(
+        user_doc["id"].encode(),
+        str(user_doc.get("display_name")).encode(),
+        str(user_doc.get("profile_image")).encode(),
+        json.dumps([top_artists, top_tracks], sort_keys=True, default=str).encode(),
+        snapshot["f"],
+        str(user_doc.get("history_profile", {}).get("imported_at")).encode()
+    )
+
+async def store_snapshot(user_doc: Dict, snapshot: Dict, etag: str):
+    """Swap in a new profile snapshot and append its history entry
+    
+    The write is conditional on the history_seq the snapshot was diffed
+    against, so concurrent refreshes of one user (from any worker) each get
+    their own version and every delta applies to the version stored before
+    it. The history entry is written before returning, not buffered: a lost
+    entry would leave later deltas with nothing to apply to.
+    """
+    current = user_doc
+    for _ in range(SNAPSHOT_WRITE_ATTEMPTS):
+        previous_seq = current.get("history_seq")
+        # With no history under this id yet (first refresh, or the first one
+        # after a re-login) the first entry is a keyframe, not a delta
+        previous = current.get("profile_snapshot") if previous_seq else None
+        delta = diff_snapshots(previous, snapshot)
+        # Stamp every attempt so history times rise with seq across workers
+        snapshot["u"] = datetime.now(timezone.utc)
+        update = {"$set": {"profile_snapshot": snapshot, "profile_etag": etag}}
+        if delta is not None:
+            # Changed taste bumps the version and records it in the history
+            update["$inc"] = {"history_seq": 1}
+        result = await db.spotify_users.update_one({"id": user_doc["id"], "history_seq": previous_seq}, update)
+        if result.matched_count:
+            if delta is not None:
+                seq = (previous_seq or 0) + 1
+                await db.profile_history.insert_one(history_entry(user_doc["id"], seq, delta, snapshot))
+            return
+        # Another refresh stored a version first; diff against that one
+        current = await db.spotify_users.find_one(
+            {"id": user_doc["id"]}, {"profile_snapshot": 1, "history_seq": 1}
+        ) or {}
+    logger.warning(f"Gave up storing the snapshot of user {user_doc['id']} after {SNAPSHOT_WRITE_ATTEMPTS} conflicting writes")
+
 async def get_spotify_token(code: str):
     """Exchange authorization code for access token"""
     token_url = "https://accounts.spotify.com/api/token"
     
-    auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
+    config = spotify_config()
+    auth_header = base64.b64encode(f"{config['client_id']}:{config['client_secret']}".encode()).decode()
     
     headers = {
         "Authorization": f"Basic {auth_header}",
@@ -106,23 +306,23 @@ async def get_spotify_token(code: str):
     data = {
         "grant_type": "authorization_code",
         "code": code,
-        "redirect_uri": SPOTIFY_REDIRECT_URI
+        "redirect_uri": config["redirect_uri"]
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, headers=headers, data=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            error_detail = f"Spotify API error: {response.status_code} - {response.text}"
-            logger.error(error_detail)
-            raise HTTPException(status_code=400, detail=error_detail)
+    response = await spotify_http().post(token_url, headers=headers, data=data, timeout=outbound_timeout(SPOTIFY_TIMEOUT_SECONDS))
+    if response.status_code == 200:
+        return response.json()
+    else:
+        error_detail = f"Spotify API error: {response.status_code} - {response.text}"
+        logger.error(error_detail)
+        raise HTTPException(status_code=400, detail=error_detail)
 
 async def refresh_spotify_token(refresh_token: str):
     """Refresh Spotify access token"""
     token_url = "https://accounts.spotify.com/api/token"
     
-    auth_header = base64.b64encode(f"{SPOTIFY_CLIENT_ID}:{SPOTIFY_CLIENT_SECRET}".encode()).decode()
+    config = spotify_config()
+    auth_header = base64.b64encode(f"{config['client_id']}:{config['client_secret']}".encode()).decode()
     
     headers = {
         "Authorization": f"Basic {auth_header}",
@@ -134,35 +334,32 @@ async def refresh_spotify_token(refresh_token: str):
         "refresh_token": refresh_token
     }
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(token_url, headers=headers, data=data)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise HTTPException(status_code=400, detail="Failed to refresh Spotify token")
+    response = await spotify_http().post(token_url, headers=headers, data=data, timeout=outbound_timeout(SPOTIFY_TIMEOUT_SECONDS))
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise HTTPException(status_code=400, detail="Failed to refresh Spotify token")
 
 async def get_spotify_user_profile(access_token: str):
     """Get Spotify user profile"""
     headers = {"Authorization": f"Bearer {access_token}"}
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get("https://api.spotify.com/v1/me", headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise HTTPException(status_code=400, detail="Failed to get user profile")
+    response = await spotify_http().get("https://api.spotify.com/v1/me", headers=headers, timeout=outbound_timeout(SPOTIFY_TIMEOUT_SECONDS))
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise HTTPException(status_code=400, detail="Failed to get user profile")
 
 async def get_user_top_items(access_token: str, item_type: str, limit: int = 20, time_range: str = "medium_term"):
     """Get user's top artists or tracks"""
     headers = {"Authorization": f"Bearer {access_token}"}
     url = f"https://api.spotify.com/v1/me/top/{item_type}?limit={limit}&time_range={time_range}"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"items": []}
+    response = await spotify_http().get(url, headers=headers, timeout=outbound_timeout(SPOTIFY_TIMEOUT_SECONDS))
+    if response.status_code == 200:
+        return response.json()
+    else:
+        return {"items": []}
 
 async def get_audio_features(access_token: str, track_ids: List[str]):
     """Get audio features for tracks"""
@@ -173,83 +370,11 @@ async def get_audio_features(access_token: str, track_ids: List[str]):
     ids = ",".join(track_ids[:100])  # API limit is 100
     url = f"https://api.spotify.com/v1/audio-features?ids={ids}"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {"audio_features": []}
-
-def calculate_similarity(user1_data: Dict, user2_data: Dict) -> Dict:
-    """Calculate similarity between two users"""
-    
-    # Get shared artists
-    user1_artists = {artist['id']: artist for artist in user1_data['top_artists']}
-    user2_artists = {artist['id']: artist for artist in user2_data['top_artists']}
-    shared_artists = []
-    
-    for artist_id, artist in user1_artists.items():
-        if artist_id in user2_artists:
-            shared_artists.append(artist)
-    
-    # Get shared tracks
-    user1_tracks = {track['id']: track for track in user1_data['top_tracks']}
-    user2_tracks = {track['id']: track for track in user2_data['top_tracks']}
-    shared_tracks = []
-    
-    for track_id, track in user1_tracks.items():
-        if track_id in user2_tracks:
-            shared_tracks.append(track)
-    
-    # Get shared genres
-    shared_genres = list(set(user1_data['genres']).intersection(set(user2_data['genres'])))
-    
-    # Calculate audio features similarity
-    audio_features_comparison = {}
-    features = ['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence', 'tempo']
-    
-    for feature in features:
-        user1_avg = user1_data['audio_features'].get(feature, 0)
-        user2_avg = user2_data['audio_features'].get(feature, 0)
-        
-        # Calculate similarity (1 - absolute difference)
-        if feature == 'tempo':
-            # Normalize tempo (typical range 60-200)
-            user1_norm = min(max(user1_avg / 200, 0), 1)
-            user2_norm = min(max(user2_avg / 200, 0), 1)
-            similarity = 1 - abs(user1_norm - user2_norm)
-        else:
-            similarity = 1 - abs(user1_avg - user2_avg)
-        
-        audio_features_comparison[feature] = {
-            'user1': user1_avg,
-            'user2': user2_avg,
-            'similarity': similarity
-        }
-    
-    # Calculate overall similarity score
-    artist_similarity = len(shared_artists) / max(len(user1_data['top_artists']), 1)
-    track_similarity = len(shared_tracks) / max(len(user1_data['top_tracks']), 1)
-    genre_similarity = len(shared_genres) / max(len(set(user1_data['genres']).union(set(user2_data['genres']))), 1)
-    
-    # Average audio features similarity
-    avg_audio_similarity = sum(comp['similarity'] for comp in audio_features_comparison.values()) / len(audio_features_comparison)
-    
-    # Weighted overall similarity
-    overall_similarity = (
-        artist_similarity * 0.3 +
-        track_similarity * 0.3 +
-        genre_similarity * 0.2 +
-        avg_audio_similarity * 0.2
-    )
-    
-    return {
-        'similarity_score': round(overall_similarity * 100, 1),
-        'shared_artists': shared_artists,
-        'shared_tracks': shared_tracks,
-        'shared_genres': shared_genres,
-        'audio_features_comparison': audio_features_comparison
-    }
+    response = await spotify_http().get(url, headers=headers, timeout=outbound_timeout(SPOTIFY_TIMEOUT_SECONDS))
+    if response.status_code == 200:
+        return response.json()
+    else:
+        return {"audio_features": []}
 
 @api_router.get("/auth/spotify")
 async def spotify_auth():
@@ -257,10 +382,11 @@ async def spotify_auth():
     state = secrets.token_urlsafe(32)  # Longer, more secure state
     scope = "user-read-private user-read-email user-top-read"
     
+    config = spotify_config()
     params = {
-        "client_id": SPOTIFY_CLIENT_ID,
+        "client_id": config["client_id"],
         "response_type": "code",
-        "redirect_uri": SPOTIFY_REDIRECT_URI,
+        "redirect_uri": config["redirect_uri"],
         "scope": scope,
         "state": state
     }
@@ -293,10 +419,10 @@ async def spotify_callback(code: str = Query(...), state: str = Query(...)):
         user = SpotifyUser(**user_data)
         user_dict = prepare_for_mongo(user.dict())
         
-        # Save or update user
+        # Save or update user; a login issues a new id, so its history starts over
         await db.spotify_users.update_one(
             {"spotify_id": user.spotify_id},
-            {"$set": user_dict},
+            {"$set": user_dict, "$unset": {"profile_etag": "", "history_seq": ""}},
             upsert=True
         )
         
@@ -305,9 +431,11 @@ async def spotify_callback(code: str = Query(...), state: str = Query(...)):
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@api_router.get("/user/{user_id}/profile")
-async def get_user_full_profile(user_id: str):
-    """Get complete user profile with music data"""
+async def build_user_profile(user_id: str):
+    """Fetch a user's music data from Spotify and store the snapshot
+    
+    Returns the profile and the ETag of its response.
+    """
     try:
         # Find user
         user_doc = await db.spotify_users.find_one({"id": user_id})
@@ -354,21 +482,48 @@ async def get_user_full_profile(user_id: str):
             top_artists=top_artists,
             top_tracks=top_tracks,
             audio_features=avg_features,
-            genres=genres
+            genres=genres,
+            history_top_artists=user_doc.get("history_profile", {}).get("top_artists", []),
+            history_top_tracks=user_doc.get("history_profile", {}).get("top_tracks", [])
         )
         
-        return profile
+        # Persist the snapshot and fold it into the recommender
+        snapshot = await encode_profile(interner, top_artists, top_tracks, genres, avg_features)
+        etag = profile_response_etag(user_doc, snapshot, top_artists, top_tracks)
+        await store_snapshot(user_doc, snapshot, etag)
+        recommender.update_user(user_doc["spotify_id"], top_artists, recommender_tracks(user_doc, top_tracks))
+        profile_etags.set(user_doc["id"], etag)
+        
+        return profile, etag
         
+    except HTTPException:
+        raise
+    except (httpx.TimeoutException, DeadlineExceeded) as e:
+        raise HTTPException(status_code=504, detail=f"Spotify request timed out: {e}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@api_router.post("/compare")
+@api_router.get("/user/{user_id}/profile")
+async def get_user_full_profile(user_id: str, request: Request, response: Response):
+    """Get complete user profile with music data"""
+    # Answer revalidations from the last known snapshot without touching Spotify or Mongo
+    etag = profile_etags.get(user_id)
+    if etag and etag_matches(request, etag):
+        return not_modified(etag)
+    
+    profile, etag = await build_user_profile(user_id)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return profile
+
+@api_router.post("/compare", dependencies=[Depends(compare_admission)])
 async def compare_users(user1_id: str, user2_id: str):
     """Compare two users' music tastes"""
     try:
         # Get both user profiles
-        user1_profile = await get_user_full_profile(user1_id)
-        user2_profile = await get_user_full_profile(user2_id)
+        user1_profile, _ = await build_user_profile(user1_id)
+        user2_profile, _ = await build_user_profile(user2_id)
         
         # Convert to dict for comparison
         user1_data = user1_profile.dict()
@@ -377,6 +532,18 @@ async def compare_users(user1_id: str, user2_id: str):
         # Calculate similarity
         comparison_data = calculate_similarity(user1_data, user2_data)
         
+        # Cache the pair score so offline jobs can recompute it after scoring changes
+        await write_buffer.submit("comparisons", UpdateOne(
+            {"user1_id": user1_id, "user2_id": user2_id},
+            {"$set": {
+                "similarity_score": comparison_data['similarity_score'],
+                "components": pack_components(comparison_data['components']),
+                "scoring_version": SCORING_VERSION,
+                "computed_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        ))
+        
         # Generate recommendations
         recommendations = []
         if comparison_data['similarity_score'] > 70:
@@ -397,23 +564,169 @@ async def compare_users(user1_id: str, user2_id: str):
             shared_tracks=comparison_data['shared_tracks'],
             shared_genres=comparison_data['shared_genres'],
             audio_features_comparison=comparison_data['audio_features_comparison'],
-            recommendations=recommendations
+            recommendations=recommendations,
+            recommended_for_user1=recommender.recommend(user1_profile.spotify_id, limit=10, boost_user_id=user2_profile.spotify_id),
+            recommended_for_user2=recommender.recommend(user2_profile.spotify_id, limit=10, boost_user_id=user1_profile.spotify_id),
+            score_components=comparison_data['components']
         )
         
         return result
         
+    except HTTPException:
+        raise
+    except (httpx.TimeoutException, DeadlineExceeded) as e:
+        raise HTTPException(status_code=504, detail=f"Spotify request timed out: {e}")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+def keep_top_scores(docs: List[Dict], scores: np.ndarray, limit: int):
+    """The `limit` highest-scoring docs and their scores, best first"""
+    top = np.arange(len(docs))
+    if len(docs) > limit:
+        top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [docs[i] for i in top], scores[top]
+
+@api_router.post("/scores")
+async def rank_scores(query: ScoreQuery):
+    """Rescore stored comparisons with custom weights and return the top pairs
+    
+    Pairs are scored a cursor batch at a time and only the running top
+    `limit` are kept, so memory stays bounded. Without a user filter the scan
+    covers the SCORES_MAX_SCAN most recently cached pairs.
+    """
+    try:
+        weight_vector(query.weights)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    mongo_filter = {"components": {"$exists": True}}
+    if query.user_id and query.other_user_id:
+        mongo_filter["user1_id"] = query.user_id
+        mongo_filter["user2_id"] = query.other_user_id
+    elif query.user_id:
+        mongo_filter["$or"] = [{"user1_id": query.user_id}, {"user2_id": query.user_id}]
+    
+    cursor = db.comparisons.find(
+        mongo_filter, {"_id": 0, "user1_id": 1, "user2_id": 1, "components": 1}
+    ).batch_size(SCORES_BATCH_SIZE)
+    if not query.user_id:
+        cursor = cursor.sort("_id", -1).limit(SCORES_MAX_SCAN)
+    
+    top_docs, top_scores = [], np.zeros(0)
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= SCORES_BATCH_SIZE:
+            scores = np.concatenate([top_scores, score_matrix([doc["components"] for doc in batch], query.weights)])
+            top_docs, top_scores = keep_top_scores(top_docs + batch, scores, query.limit)
+            batch = []
+    if batch:
+        scores = np.concatenate([top_scores, score_matrix([doc["components"] for doc in batch], query.weights)])
+        top_docs, top_scores = keep_top_scores(top_docs + batch, scores, query.limit)
+    
+    return [
+        {
+            "user1_id": doc["user1_id"],
+            "user2_id": doc["user2_id"],
+            "similarity_score": float(score),
+            "components": unpack_components(doc["components"])
+        }
+        for doc, score in zip(top_docs, top_scores)
+    ]
+
+@api_router.get("/user/{user_id}/history")
+async def get_profile_at(user_id: str, response: Response, at: datetime = Query(...)):
+    """Reconstruct a user's stored taste profile as of a point in time"""
+    state = await reconstruct(db, user_id, at)
+    if state is None:
+        raise HTTPException(status_code=404, detail="No profile history at that time")
+    
+    # Versions are stamped when written, so only a settled past can be cached
+    if naive_utc(at) < naive_utc(datetime.now(timezone.utc) - HISTORY_SETTLED_AFTER):
+        response.headers["Cache-Control"] = "private, max-age=3600"
+    return {
+        "user_id": user_id,
+        "at": at,
+        "top_artists": await interner.lookup(state["top_artist_ids"]),
+        "top_tracks": await interner.lookup(state["top_track_ids"]),
+        "genres": [genre.get("name") for genre in await interner.lookup(state["genre_ids"])],
+        "audio_features": state["audio_features"]
+    }
+
+@api_router.get("/compare/{user1_id}/{user2_id}/trend")
+async def get_similarity_trend(user1_id: str, user2_id: str, since: Optional[datetime] = None):
+    """Similarity of two users after every change in either profile"""
+    timeline1 = await load_timeline(db, user1_id, since)
+    timeline2 = await load_timeline(db, user2_id, since)
+    points = similarity_trend(timeline1, timeline2)
+    if since is not None:
+        since = naive_utc(since)
+        points = [point for point in points if point["at"] >= since]
+    return {"user1_id": user1_id, "user2_id": user2_id, "points": points}
+
 @api_router.get("/users")
-async def get_all_users():
+async def get_all_users(request: Request, response: Response):
     """Get all users for selection"""
     users = await db.spotify_users.find({}, {"id": 1, "display_name": 1, "profile_image": 1, "spotify_id": 1}).to_list(100)
-    return [parse_from_mongo(user) for user in users]
+    users = [parse_from_mongo(user) for user in users]
+    
+    etag = make_etag(json.dumps(users, default=str, sort_keys=True).encode())
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return users
+
+@api_router.get("/user/{user_id}/similar")
+async def get_similar_users(user_id: str, limit: int = Query(10, ge=1, le=100)):
+    """Rank all stored profiles by similarity to a user"""
+    store = vector_store.current()
+    if store is None:
+        raise HTTPException(status_code=503, detail="Profile vector store is not built yet")
+    
+    matches = store.similar_users(user_id, limit)
+    if not matches and store.row(user_id) is None:
+        raise HTTPException(status_code=404, detail="User has no stored profile")
+    
+    users = await db.spotify_users.find(
+        {"id": {"$in": [match_id for match_id, _ in matches]}},
+        {"_id": 0, "id": 1, "display_name": 1, "profile_image": 1}
+    ).to_list(len(matches))
+    users_by_id = {user["id"]: user for user in users}
+    return [
+        {**users_by_id.get(match_id, {"id": match_id}), "similarity_score": score}
+        for match_id, score in matches
+    ]
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests"""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: caches are warm and background services are running"""
+    store = vector_store.current()
+    details = {
+        "recommender_profiles": len(recommender),
+        "vector_store_users": store.n_users if store is not None else 0,
+        "write_buffer_pending": write_buffer.queue.qsize(),
+        "compare_active": compare_admission.active,
+        "indexes": getattr(app.state, "indexes", "building")
+    }
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "warming", **details})
+    return {"status": "ready", **details}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(CachePolicyMiddleware)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -429,6 +742,138 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def create_indexes() -> List[str]:
+    """Create every index; returns the names of those Mongo rejected
+    
+    A rejected index (e.g. a unique index over existing duplicates) will not
+    build by retrying, so it is logged and the rest are still created.
+    Connection errors propagate so the caller can retry.
+    """
+    builds = {
+        "spotify_items.key": interner.ensure_indexes,
+        "profile_history.user_id_seq": lambda: db.profile_history.create_index([("user_id", 1), ("seq", 1)], unique=True),
+        "spotify_users.profile_snapshot_u": lambda: db.spotify_users.create_index([("profile_snapshot.u", -1)]),
+        "listening_stats.user_id_type_key": lambda: db.listening_stats.create_index([("user_id", 1), ("type", 1), ("key", 1)], unique=True),
+        # One cached document per ordered pair; user2_id serves the $or in /api/scores
+        "comparisons.user1_id_user2_id": lambda: db.comparisons.create_index([("user1_id", 1), ("user2_id", 1)], unique=True),
+        "comparisons.user2_id": lambda: db.comparisons.create_index("user2_id"),
+    }
+    failed = []
+    for name, build in builds.items():
+        try:
+            await build()
+        except OperationFailure as e:
+            logger.error(f"Could not create index {name}: {e}")
+            failed.append(name)
+    return failed
+
+async def build_indexes(app: FastAPI):
+    """Create indexes in the background, retrying until Mongo answers
+    
+    Readiness does not wait for this; the outcome is reported on /readyz.
+    """
+    delay = 1
+    while True:
+        try:
+            failed = await create_indexes()
+            break
+        except Exception as e:
+            logger.error(f"Index creation failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+    if failed:
+        app.state.indexes = f"failed: {', '.join(failed)}"
+        logger.warning(f"Serving without indexes {', '.join(failed)}")
+    else:
+        app.state.indexes = "ready"
+        logger.info("Indexes ready")
+
+async def sync_recommender():
+    """Fold profile snapshots stored since the last sync into this worker's recommender
+    
+    The first sync loads every stored profile. Later ones only read snapshots
+    refreshed since the previous sync (with some overlap for in-flight writes
+    and clock skew); unchanged rows are a no-op in update_user.
+    """
+    global recommender_synced_at
+    started = datetime.now(timezone.utc)
+    query = {"profile_snapshot": {"$exists": True}}
+    if recommender_synced_at is not None:
+        query["profile_snapshot.u"] = {"$gte": recommender_synced_at - RECOMMENDER_SYNC_OVERLAP}
+    cursor = db.spotify_users.find(query, {"spotify_id": 1, "profile_snapshot": 1, "history_profile.top_tracks": 1})
+    count = 0
+    async for user_doc in cursor:
+        top_artists, top_tracks = await snapshot_items(interner, user_doc["profile_snapshot"])
+        recommender.update_user(user_doc["spotify_id"], top_artists, recommender_tracks(user_doc, top_tracks))
+        count += 1
+    recommender_synced_at = started
+    logger.info(f"Recommender synced {count} profiles, {len(recommender)} in total")
+
+async def refresh_recommender():
+    """Re-sync the recommender on an interval, run by every worker"""
+    while True:
+        await asyncio.sleep(RECOMMENDER_SYNC_SECONDS)
+        try:
+            await sync_recommender()
+        except Exception as e:
+            logger.error(f"Recommender sync failed: {e}")
+
+async def preload_hot_profiles():
+    """Seed ETags for the most recently refreshed profiles"""
+    cursor = db.spotify_users.find(
+        {"profile_etag": {"$exists": True}},
+        {"id": 1, "profile_etag": 1}
+    ).sort("profile_snapshot.u", -1).limit(WARMUP_PROFILES)
+    count = 0
+    async for user_doc in cursor:
+        profile_etags.set(user_doc["id"], user_doc["profile_etag"])
+        count += 1
+    logger.info(f"Preloaded {count} hot profiles")
+
+async def warm_up(app: FastAPI, preload: bool = True):
+    """Preload caches, retrying until Mongo answers; then report ready"""
+    delay = 1
+    while preload:
+        try:
+            await sync_recommender()
+            await preload_hot_profiles()
+            store = vector_store.current()
+            if store is not None:
+                store.prefetch()
+            break
+        except Exception as e:
+            logger.error(f"Warm-up failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+    app.state.ready = True
+    logger.info("Warm-up complete, ready to serve")
+
+async def rebuild_vector_store():
+    """Pack every compact snapshot into a new store file and swap it in"""
+    rows = []
+    cursor = db.spotify_users.find({"profile_snapshot.v": {"$exists": True}}, {"id": 1, "profile_snapshot": 1})
+    async for user_doc in cursor:
+        if is_compact(user_doc["profile_snapshot"]):
+            rows.append((user_doc["id"], CompactProfile(user_doc["profile_snapshot"])))
+    await asyncio.get_running_loop().run_in_executor(None, write_store, VECTOR_STORE_PATH, rows)
+    logger.info(f"Vector store rebuilt with {len(rows)} profiles")
+
+async def claim_vector_store_writer():
+    """Retry the writer lock until this worker holds it, then run the writer loop
+    
+    Every worker keeps trying, so when the holder exits (e.g. an old worker
+    during a rolling deploy) one of the survivors takes over rebuilds.
+    """
+    while not vector_store_lock.acquire():
+        await asyncio.sleep(VECTOR_STORE_LOCK_RETRY_SECONDS)
+    logger.info("Acquired the vector store writer lock")
+    await refresh_vector_store()
+
+async def refresh_vector_store():
+    """Writer loop, run only by the worker holding the store lock"""
+    while True:
+        try:
+            await rebuild_vector_store()
+        except Exception as e:
+            logger.error(f"Vector store rebuild failed: {e}")
+        await asyncio.sleep(VECTOR_STORE_REFRESH_SECONDS)
@@ -0,0 +1,141 @@
+"""Pairwise music taste similarity, shared by the API and offline jobs"""
+
+from typing import Dict, Optional
+
+import numpy as np
+from bson.binary import Binary
+
+from profile_codec import AUDIO_FEATURES
+
+# Bump when the scoring formula or weights change so stored scores can be recomputed
+SCORING_VERSION = 2
+
+# Order of the persisted component vector
+COMPONENTS = ['artist', 'track', 'genre'] + [f'audio_{feature}' for feature in AUDIO_FEATURES]
+
+DEFAULT_WEIGHTS = {'artist': 0.3, 'track': 0.3, 'genre': 0.2, 'audio': 0.2}
+
+def weight_vector(weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """Normalized weights in COMPONENTS order
+
+    `audio` is spread evenly over the audio features; `audio_<feature>`
+    keys weight single features instead.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    unknown = set(weights) - set(COMPONENTS) - {'audio'}
+    if unknown:
+        raise ValueError(f"Unknown weight(s): {', '.join(sorted(unknown))}")
+    if any(value < 0 for value in weights.values()):
+        raise ValueError("Weights must not be negative")
+    
+    audio_share = weights.pop('audio') / len(AUDIO_FEATURES)
+    vector = np.array([weights.get(name, audio_share) for name in COMPONENTS], dtype=np.float64)
+    total = vector.sum()
+    if total <= 0:
+        raise ValueError("At least one weight must be positive")
+    return vector / total
+
+def normalize_feature(feature: str, value: float) -> float:
+    """Audio feature on a 0-1 scale; tempo is normalized over its typical 0-200 BPM range"""
+    if feature == 'tempo':
+        return min(max(value / 200, 0), 1)
+    return value
+
+def feature_similarity(feature: str, value1: float, value2: float) -> float:
+    """Similarity of one averaged audio feature (1 - absolute difference)"""
+    return 1 - abs(normalize_feature(feature, value1) - normalize_feature(feature, value2))
+
+def similarity_components(shared_artists: int, user1_artists: int, shared_tracks: int, user1_tracks: int,
+                          shared_genres: int, all_genres: int,
+                          features1: Dict[str, float], features2: Dict[str, float]) -> Dict[str, float]:
+    """Component similarities (0-1) from item counts and averaged audio features
+    
+    Artist and track overlap is relative to the first user's top list; genres
+    use the Jaccard index of both genre sets.
+    """
+    components = {
+        'artist': shared_artists / max(user1_artists, 1),
+        'track': shared_tracks / max(user1_tracks, 1),
+        'genre': shared_genres / max(all_genres, 1),
+    }
+    for feature in AUDIO_FEATURES:
+        components[f'audio_{feature}'] = feature_similarity(feature, features1.get(feature, 0), features2.get(feature, 0))
+    return components
+
+def round_scores(similarity):
+    """Weighted similarities (0-1) as 0-100 scores with one decimal
+    
+    Rounds to four decimals first, so float32 storage or a different
+    summation order cannot flip a .x5 tie between code paths.
+    """
+    return np.round(np.round(similarity * 100, 4), 1)
+
+def weighted_score(components: Dict[str, float], vector: Optional[np.ndarray] = None) -> float:
+    """Overall similarity (0-100) of one component dict, default weights unless a weight_vector is given"""
+    if vector is None:
+        vector = weight_vector()
+    return float(round_scores(np.array([components[name] for name in COMPONENTS]) @ vector))
+
+def pack_components(components: Dict[str, float]) -> Binary:
+    """Component similarities as float32 in COMPONENTS order"""
+    return Binary(np.array([components[name] for name in COMPONENTS], dtype='<f4').tobytes())
+
+def unpack_components(data: bytes) -> Dict[str, float]:
+    return dict(zip(COMPONENTS, np.frombuffer(data, dtype='<f4').tolist()))
+
+def score_matrix(packed: list, weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """Scores (0-100) for many packed component vectors with one dot product"""
+    if not packed:
+        return np.zeros(0)
+    matrix = np.frombuffer(b''.join(packed), dtype='<f4').reshape(len(packed), len(COMPONENTS))
+    return round_scores(matrix @ weight_vector(weights))
+
+def calculate_similarity(user1_data: Dict, user2_data: Dict) -> Dict:
+    """Calculate similarity between two users"""
+    
+    # Get shared artists
+    user1_artists = {artist['id']: artist for artist in user1_data['top_artists']}
+    user2_artists = {artist['id']: artist for artist in user2_data['top_artists']}
+    shared_artists = []
+    
+    for artist_id, artist in user1_artists.items():
+        if artist_id in user2_artists:
+            shared_artists.append(artist)
+    
+    # Get shared tracks
+    user1_tracks = {track['id']: track for track in user1_data['top_tracks']}
+    user2_tracks = {track['id']: track for track in user2_data['top_tracks']}
+    shared_tracks = []
+    
+    for track_id, track in user1_tracks.items():
+        if track_id in user2_tracks:
+            shared_tracks.append(track)
+    
+    # Get shared genres
+    shared_genres = list(set(user1_data['genres']).intersection(set(user2_data['genres'])))
+    
+    # Component similarities, combined below with the default weights
+    components = similarity_components(
+        len(shared_artists), len(user1_data['top_artists']),
+        len(shared_tracks), len(user1_data['top_tracks']),
+        len(shared_genres), len(set(user1_data['genres']).union(set(user2_data['genres']))),
+        user1_data['audio_features'], user2_data['audio_features']
+    )
+    
+    # Audio features side by side
+    audio_features_comparison = {}
+    for feature in AUDIO_FEATURES:
+        audio_features_comparison[feature] = {
+            'user1': user1_data['audio_features'].get(feature, 0),
+            'user2': user2_data['audio_features'].get(feature, 0),
+            'similarity': components[f'audio_{feature}']
+        }
+    
+    return {
+        'similarity_score': weighted_score(components),
+        'components': components,
+        'shared_artists': shared_artists,
+        'shared_tracks': shared_tracks,
+        'shared_genres': shared_genres,
+        'audio_features_comparison': audio_features_comparison
+    }
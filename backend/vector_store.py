@@ -0,0 +1,215 @@
+"""Memory-mapped profile vector store shared by all uvicorn workers.
+
+One writer packs every compact profile snapshot into a single flat file:
+
+    header | user ids (sorted) | feature matrix (float32) |
+    per kind (artist, track, genre): offsets (uint64), item ids (uint32), owner rows (uint32)
+
+and swaps it in with os.replace. Every worker maps the current file
+read-only, so all processes share one copy in the page cache and a lookup is
+a numpy view over the mapping - nothing is deserialized per request. Readers
+notice a swapped file by its inode and remap on their next access.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from profile_codec import AUDIO_FEATURES, CompactProfile
+from similarity import normalize_feature, round_scores, weight_vector
+
+MAGIC = b"MCVS"
+FORMAT_VERSION = 1
+KINDS = ("artist", "track", "genre")
+
+# magic, version, users, feature dim, id width, then per kind: value count
+HEADER = struct.Struct("<4sIIII" + "Q" * len(KINDS))
+ALIGN = 8
+
+
+def _pad(size: int) -> int:
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def feature_vector(audio_features: Dict[str, float]) -> List[float]:
+    """Features in AUDIO_FEATURES order, normalized like calculate_similarity"""
+    return [normalize_feature(feature, audio_features.get(feature, 0)) for feature in AUDIO_FEATURES]
+
+
+def _layout(n_users: int, id_width: int, dim: int, counts: Tuple[int, ...]):
+    """Byte offsets of every section for the given sizes"""
+    sections = {}
+    position = _pad(HEADER.size)
+    sections["ids"] = position
+    position = _pad(position + n_users * id_width)
+    sections["features"] = position
+    position = _pad(position + n_users * dim * 4)
+    for kind, count in zip(KINDS, counts):
+        sections[f"{kind}_offsets"] = position
+        position = _pad(position + (n_users + 1) * 8)
+        sections[f"{kind}_values"] = position
+        position = _pad(position + count * 4)
+        sections[f"{kind}_owners"] = position
+        position = _pad(position + count * 4)
+    return sections, position
+
+
+def write_store(path: Path, rows: Iterable[Tuple[str, CompactProfile]]):
+    """Pack (user_id, profile) rows into a new store file and atomically swap it in"""
+    rows = sorted(rows, key=lambda row: row[0])
+    n_users = len(rows)
+    dim = len(AUDIO_FEATURES)
+    id_width = max((len(user_id.encode()) for user_id, _ in rows), default=1)
+    item_lists = {
+        "artist": [profile.artist_ids for _, profile in rows],
+        "track": [profile.track_ids for _, profile in rows],
+        "genre": [profile.genre_ids for _, profile in rows],
+    }
+    counts = tuple(sum(len(items) for items in item_lists[kind]) for kind in KINDS)
+    sections, size = _layout(n_users, id_width, dim, counts)
+
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    with open(tmp_path, "wb+") as fp:
+        fp.truncate(max(size, 1))
+        with mmap.mmap(fp.fileno(), max(size, 1)) as mm:
+            HEADER.pack_into(mm, 0, MAGIC, FORMAT_VERSION, n_users, dim, id_width, *counts)
+            ids = np.frombuffer(mm, dtype=f"S{id_width}", count=n_users, offset=sections["ids"])
+            ids[:] = [user_id.encode() for user_id, _ in rows]
+            features = np.frombuffer(mm, dtype=np.float32, count=n_users * dim, offset=sections["features"]).reshape(n_users, dim)
+            for row, (_, profile) in enumerate(rows):
+                features[row] = feature_vector(profile.audio_features)
+            for kind, count in zip(KINDS, counts):
+                lengths = np.array([len(items) for items in item_lists[kind]], dtype=np.uint64)
+                offsets = np.frombuffer(mm, dtype=np.uint64, count=n_users + 1, offset=sections[f"{kind}_offsets"])
+                offsets[0] = 0
+                np.cumsum(lengths, out=offsets[1:])
+                values = np.frombuffer(mm, dtype=np.uint32, count=count, offset=sections[f"{kind}_values"])
+                owners = np.frombuffer(mm, dtype=np.uint32, count=count, offset=sections[f"{kind}_owners"])
+                for row, items in enumerate(item_lists[kind]):
+                    start, end = int(offsets[row]), int(offsets[row + 1])
+                    # Sorted rows allow merge-style intersections
+                    values[start:end] = np.sort(np.frombuffer(items, dtype=np.uint32))
+                    owners[start:end] = row
+            del ids, features, offsets, values, owners
+            mm.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp_path, path)
+
+
+class WriterLock:
+    """Non-blocking exclusive lock so only one worker rebuilds the store"""
+
+    def __init__(self, path: Path):
+        self.path = Path(f"{path}.lock")
+        self.fp = None
+
+    def acquire(self) -> bool:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fp = open(self.path, "w")
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fp.close()
+            return False
+        self.fp = fp
+        return True
+
+    def release(self):
+        if self.fp:
+            fcntl.flock(self.fp, fcntl.LOCK_UN)
+            self.fp.close()
+            self.fp = None
+
+
+class MappedStore:
+    """Read-only numpy views over one mapped store file"""
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as fp:
+            self.inode = os.fstat(fp.fileno()).st_ino
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_users, dim, id_width, *counts = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} profile vector store")
+        sections, _ = _layout(n_users, id_width, dim, tuple(counts))
+        self.n_users = n_users
+        self.ids = np.frombuffer(self.mm, dtype=f"S{id_width}", count=n_users, offset=sections["ids"])
+        self.features = np.frombuffer(self.mm, dtype=np.float32, count=n_users * dim, offset=sections["features"]).reshape(n_users, dim)
+        self.offsets, self.values, self.owners = {}, {}, {}
+        for kind, count in zip(KINDS, counts):
+            self.offsets[kind] = np.frombuffer(self.mm, dtype=np.uint64, count=n_users + 1, offset=sections[f"{kind}_offsets"])
+            self.values[kind] = np.frombuffer(self.mm, dtype=np.uint32, count=count, offset=sections[f"{kind}_values"])
+            self.owners[kind] = np.frombuffer(self.mm, dtype=np.uint32, count=count, offset=sections[f"{kind}_owners"])
+
+    def prefetch(self):
+        """Ask the kernel to page the whole mapping in ahead of the first query"""
+        if hasattr(mmap, "MADV_WILLNEED"):
+            self.mm.madvise(mmap.MADV_WILLNEED)
+
+    def row(self, user_id: str) -> Optional[int]:
+        """Row index of a user via binary search over the sorted id column"""
+        key = user_id.encode()
+        row = int(np.searchsorted(self.ids, key))
+        if row < self.n_users and self.ids[row] == key:
+            return row
+        return None
+
+    def items(self, kind: str, row: int) -> np.ndarray:
+        offsets = self.offsets[kind]
+        return self.values[kind][int(offsets[row]):int(offsets[row + 1])]
+
+    def similar_users(self, user_id: str, limit: int = 10,
+                      weights: Optional[Dict[str, float]] = None) -> List[Tuple[str, float]]:
+        """Score one user against everyone in the store with vectorized set and feature math"""
+        row = self.row(user_id)
+        if row is None:
+            return []
+
+        partial = {}
+        for kind in KINDS:
+            mine = self.items(kind, row)
+            values, owners = self.values[kind], self.owners[kind]
+            shared = np.bincount(owners[np.isin(values, mine, assume_unique=False)], minlength=self.n_users)
+            sizes = np.diff(self.offsets[kind]).astype(np.int64)
+            if kind == "genre":
+                partial[kind] = shared / np.maximum(len(mine) + sizes - shared, 1)
+            else:
+                partial[kind] = shared / max(len(mine), 1)
+        audio = 1 - np.abs(self.features - self.features[row])
+
+        # One row of components per user, columns in COMPONENTS order
+        components = np.column_stack([partial["artist"], partial["track"], partial["genre"], audio])
+        scores = components @ weight_vector(weights)
+        scores[row] = -np.inf
+
+        limit = min(limit, self.n_users - 1)
+        if limit <= 0:
+            return []
+        best = np.argpartition(-scores, limit - 1)[:limit]
+        best = best[np.argsort(-scores[best])]
+        return [(self.ids[i].decode(), float(round_scores(scores[i]))) for i in best]
+
+
+class SharedVectorStore:
+    """Per-process handle that follows atomic swaps of the store file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.mapped: Optional[MappedStore] = None
+
+    def current(self) -> Optional[MappedStore]:
+        """The mapping for the newest store file, remapping after a swap"""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return self.mapped
+        if self.mapped is None or self.mapped.inode != inode:
+            # The old mapping stays alive until views over it are released
+            self.mapped = MappedStore(self.path)
+        return self.mapped
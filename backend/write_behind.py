@@ -0,0 +1,117 @@
+"""Write-behind buffer for non-critical Mongo writes.
+
+Request handlers submit pymongo write operations (UpdateOne, InsertOne, ...)
+instead of awaiting a round trip each. A background task drains the queue and
+flushes per-collection `bulk_write` batches once `max_batch` operations are
+waiting or `flush_interval` seconds have passed since the first one arrived.
+
+The queue is bounded: when Mongo falls behind, `submit` waits for space, which
+pushes back on the request path instead of growing memory without limit.
+Batches are written ordered so two writes to the same document land in the
+order they were submitted; a failing operation is logged and skipped.
+"""
+
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindBuffer:
+    """Bounded async queue of Mongo writes flushed in batches by size or time"""
+
+    def __init__(self, db, max_batch: int = 500, flush_interval: float = 0.5, max_pending: int = 10000):
+        self.db = db
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self.task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def submit(self, collection: str, operation):
+        """Queue a write; waits only when the buffer is full"""
+        if self.task is None:
+            # Not running (e.g. scripts or tests): write through
+            await self._flush([(collection, operation)])
+            return
+        await self.queue.put((collection, operation))
+
+    async def close(self):
+        """Flush everything queued so far and stop the flusher"""
+        if self.task is None:
+            return
+        await self.queue.put(_STOP)
+        await self.task
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error(f"Write-behind flush failed: {e}")
+
+    async def _flush(self, batch: List[Tuple[str, object]]):
+        by_collection: Dict[str, list] = {}
+        for collection, operation in batch:
+            by_collection.setdefault(collection, []).append(operation)
+        for collection, operations in by_collection.items():
+            await self._bulk_write(collection, operations)
+
+    async def _bulk_write(self, collection: str, operations: list):
+        while operations:
+            try:
+                result = await self.db[collection].bulk_write(operations, ordered=True)
+                self.written += len(operations)
+                return result
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors")
+                if not write_errors:
+                    # Only the write concern failed; every operation was applied
+                    self.written += len(operations)
+                    logger.error(f"Write-behind to {collection} missed its write concern: {e.details.get('writeConcernErrors')}")
+                    return None
+                # Ordered writes stop at the first error; skip it and carry on
+                error = write_errors[0]
+                index = error["index"]
+                self.written += index
+                self.failed += 1
+                logger.error(f"Write-behind to {collection} dropped an operation: {error.get('errmsg')}")
+                operations = operations[index + 1:]
+            except PyMongoError as e:
+                self.failed += len(operations)
+                logger.error(f"Write-behind to {collection} failed for {len(operations)} operations: {e}")
+                return None
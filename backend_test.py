@@ -373,7 +373,7 @@ class SpotifyBackendTester:
             endpoints_to_test = [
                 ("/auth/spotify", "GET", 200),
                 ("/users", "GET", 200),
-                ("/user/test-id/profile", "GET", 400),  # Should return 400 for invalid user
+                ("/user/test-id/profile", "GET", 404),  # Should return 404 for unknown user
                 ("/compare", "POST", 422)  # Should return 422 for missing params (FastAPI validation)
             ]
             
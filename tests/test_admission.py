@@ -0,0 +1,135 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+import server
+from admission import AdmissionController, DeadlineExceeded, outbound_timeout, remaining_time
+
+
+def guarded_app(controller: AdmissionController, gate: asyncio.Event = None):
+    app = FastAPI()
+
+    @app.get("/work", dependencies=[Depends(controller)])
+    async def work():
+        if gate is not None:
+            await gate.wait()
+        return {"remaining": remaining_time(), "timeout": outbound_timeout(30).read}
+
+    @app.get("/fail", dependencies=[Depends(controller)])
+    async def fail():
+        raise HTTPException(status_code=404, detail="User not found")
+
+    @app.get("/open")
+    async def open_route():
+        return {"remaining": remaining_time()}
+
+    return app
+
+
+def run_requests(controller, paths, gate=None, release_after=0.05):
+    """Send requests concurrently; the gate opens after release_after seconds"""
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=guarded_app(controller, gate))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def open_gate():
+                await asyncio.sleep(release_after)
+                gate.set()
+
+            opener = asyncio.create_task(open_gate()) if gate is not None else None
+            responses = await asyncio.gather(*(client.get(path) for path in paths))
+            if opener is not None:
+                await opener
+            return responses
+
+    return asyncio.run(scenario())
+
+
+def test_full_queue_is_shed_with_retry_after():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=1, queue_timeout=1.5)
+    responses = run_requests(controller, ["/work"] * 4, gate=asyncio.Event())
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200, 200, 503, 503]
+    for response in responses:
+        if response.status_code == 503:
+            assert response.headers["retry-after"] == "2"
+            assert "wait queue is full" in response.json()["detail"]
+    assert controller.shed == 2
+    assert controller.active == controller.waiting == 0
+
+
+def test_waiters_time_out():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=5, queue_timeout=0.05)
+    responses = run_requests(controller, ["/work"] * 3, gate=asyncio.Event(), release_after=0.3)
+    assert sorted(response.status_code for response in responses) == [200, 503, 503]
+    shed = [response for response in responses if response.status_code == 503]
+    assert all("timed out" in response.json()["detail"] for response in shed)
+    assert all(response.headers["retry-after"] == "1" for response in shed)
+    assert controller.active == controller.waiting == 0
+
+
+def test_queued_requests_get_released_slots():
+    controller = AdmissionController("test", max_concurrency=2, max_queue=10, queue_timeout=5)
+    responses = run_requests(controller, ["/work"] * 8, gate=asyncio.Event())
+    assert [response.status_code for response in responses] == [200] * 8
+    assert controller.shed == 0
+    assert controller.semaphore._value == 2
+
+
+def test_slot_released_when_handler_raises():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=0, queue_timeout=1)
+    client = TestClient(guarded_app(controller))
+    for _ in range(3):
+        assert client.get("/fail").status_code == 404
+    assert controller.active == 0
+    assert client.get("/work").status_code == 200
+
+
+def test_deadline_is_visible_inside_the_request_only():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=0, queue_timeout=1, request_timeout=4)
+    client = TestClient(guarded_app(controller))
+    body = client.get("/work").json()
+    assert 0 < body["remaining"] <= 4
+    assert body["timeout"] == pytest.approx(body["remaining"], abs=0.5)
+    assert client.get("/open").json() == {"remaining": None}
+    assert remaining_time() is None
+
+
+def test_without_request_timeout_outbound_calls_keep_their_default():
+    controller = AdmissionController("test", max_concurrency=1, max_queue=0, queue_timeout=1)
+    assert TestClient(guarded_app(controller)).get("/work").json() == {"remaining": None, "timeout": 30}
+
+
+def test_expired_deadline_stops_outbound_calls():
+    async def scenario():
+        controller = AdmissionController("test", max_concurrency=1, max_queue=0, queue_timeout=1, request_timeout=0.01)
+        dependency = controller()
+        await dependency.__anext__()
+        try:
+            await asyncio.sleep(0.02)
+            with pytest.raises(DeadlineExceeded):
+                outbound_timeout(5)
+        finally:
+            await dependency.aclose()
+        assert controller.active == 0
+
+    asyncio.run(scenario())
+
+
+class MissingUsers:
+    async def find_one(self, query, projection=None):
+        return None
+
+
+def test_unknown_user_is_404_not_400(monkeypatch):
+    monkeypatch.setattr(server, "db", SimpleNamespace(spotify_users=MissingUsers()))
+    client = TestClient(server.app)
+    assert client.get("/api/user/nobody/profile").status_code == 404
+    response = client.post("/api/compare", params={"user1_id": "nobody", "user2_id": "other"})
+    assert response.status_code == 404
+    assert response.json()["detail"] == "User not found"
+    assert server.compare_admission.active == 0
@@ -0,0 +1,211 @@
+import gzip
+import json
+
+import pytest
+from fastapi import FastAPI
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import http_cache
+import server
+from http_cache import (
+    CachePolicyMiddleware,
+    CompressionMiddleware,
+    EtagTable,
+    choose_encoding,
+    etag_matches,
+    make_etag,
+)
+
+BIG = {"items": [{"id": i, "name": f"Track {i}"} for i in range(200)]}
+
+
+def compressed_app(**options):
+    async def big(request):
+        return JSONResponse(BIG)
+
+    async def small(request):
+        return JSONResponse({"ok": True})
+
+    async def image(request):
+        return Response(b"\x89PNG" + b"\0" * 4096, media_type="image/png")
+
+    async def streamed(request):
+        return PlainTextResponse("x" * 4096, headers={"Content-Encoding": "identity"})
+
+    app = Starlette(routes=[Route("/big", big), Route("/small", small), Route("/image", image),
+                            Route("/streamed", streamed)])
+    app.add_middleware(CompressionMiddleware, **options)
+    return TestClient(app)
+
+
+def test_large_json_is_gzipped_with_vary_and_length():
+    response = compressed_app().get("/big", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    # The client decoded it; the length on the wire is the compressed size
+    assert int(response.headers["content-length"]) < len(json.dumps(BIG))
+    assert response.json() == BIG
+
+
+def test_compressed_length_matches_body():
+    client = compressed_app()
+    with client.stream("GET", "/big", headers={"Accept-Encoding": "gzip"}) as response:
+        raw = b"".join(response.iter_raw())
+    assert int(response.headers["content-length"]) == len(raw)
+    assert json.loads(gzip.decompress(raw)) == BIG
+
+
+@pytest.mark.parametrize("path, headers", [
+    ("/small", {"Accept-Encoding": "gzip"}),
+    ("/image", {"Accept-Encoding": "gzip"}),
+    ("/streamed", {"Accept-Encoding": "gzip"}),
+    ("/big", {"Accept-Encoding": "identity"}),
+    ("/big", {"Accept-Encoding": "gzip;q=0"}),
+])
+def test_responses_left_alone(path, headers):
+    response = compressed_app().get(path, headers=headers)
+    assert response.headers.get("content-encoding") in (None, "identity")
+    assert "vary" not in response.headers
+
+
+def test_threshold_is_configurable():
+    response = compressed_app(minimum_size=5).get("/small", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json() == {"ok": True}
+
+
+def test_brotli_preferred_when_installed():
+    pytest.importorskip("brotli")
+    response = compressed_app().get("/big", headers={"Accept-Encoding": "gzip, br"})
+    assert response.headers["content-encoding"] == "br"
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip, br", ("br", "gzip")) == "br"
+    assert choose_encoding("br;q=0, gzip", ("br", "gzip")) == "gzip"
+    assert choose_encoding("*", ("gzip",)) == "gzip"
+    assert choose_encoding("deflate", ("br", "gzip")) is None
+    assert choose_encoding("", ("gzip",)) is None
+
+
+def policy_client():
+    app = FastAPI()
+
+    @app.get("/api/user/{user_id}/profile")
+    async def profile(user_id: str):
+        return {}
+
+    @app.get("/custom")
+    async def custom(response: Response):
+        response.headers["Cache-Control"] = "private, max-age=5"
+        return {}
+
+    @app.get("/other")
+    async def other():
+        return {}
+
+    app.add_middleware(CachePolicyMiddleware, policies={
+        "/api/user/{user_id}/profile": "private, no-cache",
+        "/custom": "no-store",
+    })
+    return TestClient(app)
+
+
+def test_policy_applied_by_route_template():
+    client = policy_client()
+    assert client.get("/api/user/abc/profile").headers["cache-control"] == "private, no-cache"
+    assert "cache-control" not in client.get("/other").headers
+    assert "cache-control" not in client.get("/missing").headers
+
+
+def test_handler_cache_control_wins():
+    assert policy_client().get("/custom").headers["cache-control"] == "private, max-age=5"
+
+
+def test_every_policy_names_a_real_route():
+    paths = {route.path for route in server.app.routes}
+    assert set(http_cache.CACHE_POLICIES) <= paths
+
+
+def request_with(if_none_match=None):
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request({"type": "http", "headers": headers})
+
+
+def test_etag_matching():
+    etag = make_etag(b"profile", b"v1")
+    assert etag.startswith('W/"')
+    assert etag == make_etag(b"profile", b"v1")
+    assert etag != make_etag(b"profilev1")
+    assert etag_matches(request_with(etag), etag)
+    assert etag_matches(request_with(etag.removeprefix("W/")), etag)
+    assert etag_matches(request_with(f'"other", {etag}'), etag)
+    assert etag_matches(request_with("*"), etag)
+    assert not etag_matches(request_with('"other"'), etag)
+    assert not etag_matches(request_with(), etag)
+
+
+def test_etag_table_expires_and_stays_bounded(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(http_cache.time, "monotonic", lambda: now[0])
+    table = EtagTable(ttl_seconds=10, max_entries=3)
+    table.set("a", "1")
+    now[0] += 5
+    table.set("b", "2")
+    assert table.get("a") == "1"
+
+    now[0] += 6
+    assert table.get("a") is None
+    # Expired entries go on the next write even if never read again
+    table.set("c", "3")
+    assert len(table) == 2 and table.get("b") == "2"
+
+    for key in "defg":
+        table.set(key, key)
+    assert len(table) == 3
+    assert [table.get(key) for key in "efg"] == ["e", "f", "g"]
+
+    # Refreshing a key moves it to the back of the eviction order
+    table.set("e", "e2")
+    table.set("h", "h")
+    assert table.get("e") == "e2" and table.get("f") is None
+
+
+@pytest.fixture
+def profile_client(monkeypatch):
+    monkeypatch.setattr(server, "profile_etags", EtagTable(60))
+    built = []
+
+    async def build_user_profile(user_id):
+        built.append(user_id)
+        return {"id": user_id}, make_etag(user_id.encode())
+
+    monkeypatch.setattr(server, "build_user_profile", build_user_profile)
+    return TestClient(server.app), built
+
+
+def test_profile_revalidation_short_circuits_on_known_etag(profile_client):
+    client, built = profile_client
+    etag = make_etag(b"cached")
+    server.profile_etags.set("u1", etag)
+    response = client.get("/api/user/u1/profile", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+    assert response.headers["cache-control"] == "private, no-cache"
+    assert built == []
+
+
+def test_profile_rebuilt_when_etag_unknown(profile_client):
+    client, built = profile_client
+    response = client.get("/api/user/u2/profile")
+    assert response.status_code == 200
+    assert response.json() == {"id": "u2"}
+    etag = response.headers["etag"]
+
+    response = client.get("/api/user/u2/profile", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert built == ["u2", "u2"]
@@ -0,0 +1,152 @@
+import io
+import json
+
+import pytest
+
+import import_streaming_history
+from import_streaming_history import (
+    BoundedCounter,
+    JsonArrayReader,
+    import_files,
+    load_checkpoint,
+    save_checkpoint,
+)
+
+RECORDS = [
+    {"ts": "2024-01-01T00:00:00Z", "ms_played": 200000, "spotify_track_uri": "spotify:track:aaa",
+     "master_metadata_track_name": "Jóga", "master_metadata_album_artist_name": "Björk",
+     "master_metadata_album_album_name": "Homogenic"},
+    {"ts": "2024-01-01T00:05:00Z", "ms_played": 5000, "spotify_track_uri": "spotify:track:bbb",
+     "master_metadata_track_name": "Skip", "master_metadata_album_artist_name": "Björk",
+     "master_metadata_album_album_name": "Homogenic"},
+    {"ts": "2024-01-01T00:10:00Z", "ms_played": 180000, "spotify_track_uri": "spotify:track:ccc",
+     "master_metadata_track_name": "戦場のメリークリスマス", "master_metadata_album_artist_name": "坂本龍一",
+     "master_metadata_album_album_name": "🎹"},
+    {"ts": "2024-01-01T00:15:00Z", "ms_played": 900000, "spotify_track_uri": None,
+     "episode_name": "A podcast"},
+    {"ts": "2024-01-01T00:20:00Z", "ms_played": 240000, "spotify_track_uri": "spotify:track:aaa",
+     "master_metadata_track_name": "Jóga", "master_metadata_album_artist_name": "Björk",
+     "master_metadata_album_album_name": "Homogenic"},
+]
+
+
+def export_bytes(records=RECORDS) -> bytes:
+    # Spotify exports are pretty-printed with non-ASCII left unescaped
+    return json.dumps(records, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 20])
+def test_reader_yields_every_record_across_chunk_boundaries(chunk_size):
+    reader = JsonArrayReader(io.BytesIO(export_bytes()), chunk_size=chunk_size)
+    assert list(reader) == RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 1 << 20])
+def test_resuming_from_any_offset_yields_the_rest(chunk_size):
+    data = export_bytes()
+    reader = JsonArrayReader(io.BytesIO(data), chunk_size=chunk_size)
+    offsets = []
+    for _ in reader:
+        offsets.append(reader.offset)
+
+    for done, offset in enumerate(offsets, 1):
+        resumed = JsonArrayReader(io.BytesIO(data), offset=offset, chunk_size=chunk_size)
+        assert list(resumed) == RECORDS[done:]
+
+
+def test_offsets_are_byte_positions():
+    data = export_bytes()
+    reader = JsonArrayReader(io.BytesIO(data), chunk_size=3)
+    for record in reader:
+        # Everything up to the offset is complete JSON text ending with this record
+        consumed = data[:reader.offset].decode("utf-8")
+        assert consumed.rstrip().endswith("}")
+        assert json.loads(consumed + "]")[-1] == record
+
+
+@pytest.mark.parametrize("text", [b"[]", b"  [\n]\n", b""])
+def test_empty_exports(text):
+    assert list(JsonArrayReader(io.BytesIO(text))) == []
+
+
+def test_truncated_export_raises():
+    with pytest.raises(json.JSONDecodeError):
+        list(JsonArrayReader(io.BytesIO(export_bytes()[:-40]), chunk_size=16))
+
+
+def test_bounded_counter_never_exceeds_capacity_and_keeps_new_keys():
+    counter = BoundedCounter(capacity=4)
+    for i in range(4):
+        counter.add(f"heavy{i}", 1000 * (i + 1), {"name": f"heavy{i}"})
+    counter.add("new", 10, {"name": "new"})
+
+    assert len(counter.entries) <= 4
+    assert counter.entries["new"] == {"plays": 1, "ms_played": 10, "name": "new"}
+    assert {"heavy2", "heavy3"} <= set(counter.entries)
+    assert counter.pruned == 2
+
+    for i in range(100):
+        counter.add(f"tail{i}", 1, {"name": "tail"})
+        assert len(counter.entries) <= 4
+        assert counter.entries[f"tail{i}"]["plays"] == 1
+
+
+def test_bounded_counter_top_is_ordered_by_ms_played():
+    counter = BoundedCounter(capacity=10)
+    for key, ms in (("a", 5), ("b", 50), ("a", 100), ("c", 20)):
+        counter.add(key, ms, {"name": key})
+    assert [entry["name"] for entry in counter.top(2)] == ["a", "b"]
+    assert counter.entries["a"]["plays"] == 2
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    state = load_checkpoint(path, capacity=8)
+    state["files"]["export.json"] = {"offset": 1234, "done": False}
+    state["records"], state["skipped"] = 10, 3
+    state["artists"].add("Björk", 1000, {"id": None, "name": "Björk"})
+    state["tracks"].add("aaa", 1000, {"id": "aaa", "name": "Jóga"})
+    save_checkpoint(path, state)
+
+    restored = load_checkpoint(path, capacity=8)
+    assert restored["files"] == state["files"]
+    assert (restored["records"], restored["skipped"]) == (10, 3)
+    assert restored["artists"].entries == state["artists"].entries
+    assert restored["tracks"].state() == state["tracks"].state()
+    assert not path.with_suffix(".json.tmp").exists()
+
+
+def test_interrupted_import_resumes_to_the_same_totals(tmp_path, monkeypatch):
+    records = [
+        {**RECORDS[i % len(RECORDS)], "spotify_track_uri": f"spotify:track:t{i % 7}"}
+        if RECORDS[i % len(RECORDS)]["spotify_track_uri"] else RECORDS[i % len(RECORDS)]
+        for i in range(60)
+    ]
+    paths = []
+    for name, part in (("Streaming_History_Audio_0.json", records[:35]), ("Streaming_History_Audio_1.json", records[35:])):
+        path = tmp_path / name
+        path.write_bytes(export_bytes(part))
+        paths.append(path)
+
+    expected = import_files(paths, tmp_path / "clean.json", capacity=100, min_ms=30000, checkpoint_every=4)
+
+    process_record = import_streaming_history.process_record
+    calls = {"count": 0}
+
+    def crash_midway(state, record, min_ms):
+        calls["count"] += 1
+        if calls["count"] == 47:
+            raise KeyboardInterrupt
+        process_record(state, record, min_ms)
+
+    checkpoint = tmp_path / "resume.json"
+    monkeypatch.setattr(import_streaming_history, "process_record", crash_midway)
+    with pytest.raises(KeyboardInterrupt):
+        import_files(paths, checkpoint, capacity=100, min_ms=30000, checkpoint_every=4)
+    monkeypatch.setattr(import_streaming_history, "process_record", process_record)
+    resumed = import_files(paths, checkpoint, capacity=100, min_ms=30000, checkpoint_every=4)
+
+    assert resumed["records"] == expected["records"] == 60
+    assert resumed["skipped"] == expected["skipped"]
+    assert resumed["tracks"].entries == expected["tracks"].entries
+    assert resumed["artists"].entries == expected["artists"].entries
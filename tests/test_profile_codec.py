@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import bson
+import pytest
+
+from profile_codec import (
+    AUDIO_FEATURES,
+    CompactProfile,
+    encode_snapshot,
+    is_compact,
+    pack_features,
+    pack_ids,
+    unpack_features,
+    unpack_ids,
+)
+
+FEATURES = {
+    "danceability": 0.61, "energy": 0.72, "speechiness": 0.05, "acousticness": 0.18,
+    "instrumentalness": 0.001, "liveness": 0.12, "valence": 0.44, "tempo": 121.5,
+}
+
+
+def through_mongo(doc):
+    """What the driver hands back after storing a document"""
+    return bson.decode(bson.encode(doc))
+
+
+def test_snapshot_round_trip_through_bson():
+    updated_at = datetime(2026, 5, 1, 12, 30)
+    snapshot = encode_snapshot([5, 3, 9], [1, 2], [40, 41, 42, 43], FEATURES, updated_at)
+
+    profile = CompactProfile(through_mongo(snapshot))
+    assert list(profile.artist_ids) == [5, 3, 9]
+    assert list(profile.track_ids) == [1, 2]
+    assert list(profile.genre_ids) == [40, 41, 42, 43]
+    assert profile.audio_features == pytest.approx(FEATURES, rel=1e-6)
+    assert list(profile.audio_features) == AUDIO_FEATURES
+    assert profile.updated_at == updated_at
+
+
+def test_rank_order_and_large_ids_survive():
+    ids = [2**32 - 1, 0, 70000, 1]
+    assert list(unpack_ids(through_mongo({"a": pack_ids(ids)})["a"])) == ids
+
+
+def test_empty_profile_round_trip():
+    profile = CompactProfile(through_mongo(encode_snapshot([], [], [], {})))
+    assert list(profile.artist_ids) == []
+    assert profile.audio_features == {}
+    assert profile.similarity_input() == {"top_artists": [], "top_tracks": [], "genres": [], "audio_features": {}}
+
+
+def test_missing_features_pack_as_zero():
+    assert unpack_features(pack_features({"energy": 0.5})) == {
+        feature: (0.5 if feature == "energy" else 0.0) for feature in AUDIO_FEATURES
+    }
+
+
+def test_similarity_input_is_keyed_by_interned_ids():
+    profile = CompactProfile(encode_snapshot([7, 8], [9], [10], FEATURES))
+    data = profile.similarity_input()
+    assert data["top_artists"] == [{"id": 7}, {"id": 8}]
+    assert data["top_tracks"] == [{"id": 9}]
+    assert data["genres"] == [10]
+
+
+def test_is_compact_tells_formats_apart():
+    assert is_compact(encode_snapshot([1], [2], [3], FEATURES))
+    assert not is_compact({"top_artists": [], "top_tracks": []})
+    assert not is_compact(None)
+
+
+def test_compact_snapshot_is_much_smaller_than_verbose():
+    artists = [{"id": f"artist{i:018d}", "name": f"Artist {i}", "genres": ["indie", "rock"],
+                "images": [{"url": "https://i.scdn.co/image/" + "x" * 40}] * 3} for i in range(20)]
+    tracks = [{"id": f"track{i:019d}", "name": f"Track {i}", "artists": artists[:2],
+               "album": {"name": "Album", "images": artists[0]["images"]}} for i in range(20)]
+    verbose = {"top_artists": artists, "top_tracks": tracks, "genres": ["indie", "rock"], "audio_features": FEATURES}
+    compact = encode_snapshot(range(20), range(20, 40), [1, 2], FEATURES)
+    assert len(bson.encode(compact)) * 5 < len(bson.encode(verbose))
@@ -0,0 +1,259 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from profile_codec import AUDIO_FEATURES, CompactProfile, encode_snapshot, unpack_ids
+from profile_history import (
+    KEYFRAME_INTERVAL,
+    ProfileState,
+    diff_snapshots,
+    history_entry,
+    reconstruct,
+    similarity_trend,
+)
+from similarity import calculate_similarity
+
+START = datetime(2026, 1, 1)
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    async def to_list(self, length):
+        return self.docs if length is None else self.docs[:length]
+
+
+class FakeHistory:
+    """Just enough of a Motor collection for profile_history queries"""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    @staticmethod
+    def _matches(doc, query):
+        for field, condition in query.items():
+            value = doc.get(field)
+            if isinstance(condition, dict):
+                if "$lte" in condition and not value <= condition["$lte"]:
+                    return False
+                if "$gte" in condition and not value >= condition["$gte"]:
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs if self._matches(doc, query)])
+
+    async def find_one(self, query, projection=None, sort=None):
+        cursor = self.find(query)
+        if sort:
+            cursor.sort(*sort[0])
+        return cursor.docs[0] if cursor.docs else None
+
+
+class FakeDb:
+    def __init__(self, docs):
+        self.profile_history = FakeHistory(docs)
+
+
+def evolve(rng: random.Random, user_id: str, versions: int, offset: timedelta):
+    """A user's snapshots over time and the history entries the server would store"""
+    artists = set(rng.sample(range(50), 15))
+    tracks = set(rng.sample(range(100), 15))
+    genres = set(rng.sample(range(20), 6))
+    features = {feature: rng.random() for feature in AUDIO_FEATURES}
+    snapshots, entries = [], []
+    previous, seq = None, 0
+    for version in range(versions):
+        if version:
+            for items, universe in ((artists, 50), (tracks, 100), (genres, 20)):
+                for _ in range(rng.randint(0, 3)):
+                    if items:
+                        items.discard(rng.choice(sorted(items)))
+                    items.add(rng.randrange(universe))
+            if rng.random() < 0.5:
+                features = {**features, rng.choice(AUDIO_FEATURES): rng.random()}
+        at = START + offset + timedelta(hours=version * 5)
+        snapshot = encode_snapshot(sorted(artists), sorted(tracks), sorted(genres), features, at)
+        delta = diff_snapshots(previous, snapshot)
+        if delta is not None:
+            seq += 1
+            entries.append(history_entry(user_id, seq, delta, snapshot))
+            previous = snapshot
+        snapshots.append(previous)
+    return snapshots, entries
+
+
+def state_of(snapshot):
+    profile = CompactProfile(snapshot)
+    return {
+        "top_artist_ids": sorted(profile.artist_ids),
+        "top_track_ids": sorted(profile.track_ids),
+        "genre_ids": sorted(profile.genre_ids),
+        "audio_features": profile.audio_features,
+    }
+
+
+def test_keyframes_every_interval():
+    _, entries = evolve(random.Random(1), "u", 40, timedelta())
+    keyframes = [entry["seq"] for entry in entries if entry["key"]]
+    assert keyframes[0] == 1
+    assert all(seq % KEYFRAME_INTERVAL == 1 for seq in keyframes)
+    assert len(keyframes) == (len(entries) - 1) // KEYFRAME_INTERVAL + 1
+
+
+def test_unchanged_snapshot_has_no_delta():
+    snapshot = encode_snapshot([1, 2], [3], [4], {"energy": 0.5})
+    assert diff_snapshots(snapshot, encode_snapshot([2, 1], [3], [4], {"energy": 0.5})) is None
+    assert diff_snapshots(None, snapshot) == {"full": True}
+
+
+def test_replaying_entries_rebuilds_every_version():
+    snapshots, entries = evolve(random.Random(2), "u", 30, timedelta())
+    # One entry per version that changed anything
+    changed = [snapshot for i, snapshot in enumerate(snapshots) if i == 0 or snapshot is not snapshots[i - 1]]
+    assert len(changed) == len(entries)
+    state = ProfileState()
+    for entry, snapshot in zip(entries, changed):
+        state.apply(entry)
+        assert state.to_snapshot() == state_of(snapshot)
+
+
+def test_reconstruct_matches_stored_snapshots():
+    snapshots, entries = evolve(random.Random(3), "u", 35, timedelta())
+    db = FakeDb(entries)
+    for version, snapshot in enumerate(snapshots):
+        at = START + timedelta(hours=version * 5, minutes=30)
+        assert asyncio.run(reconstruct(db, "u", at)) == state_of(snapshot)
+    assert asyncio.run(reconstruct(db, "u", START - timedelta(days=1))) is None
+
+
+def test_similarity_trend_matches_full_recompute():
+    rng = random.Random(4)
+    snapshots1, timeline1 = evolve(rng, "u1", 30, timedelta())
+    snapshots2, timeline2 = evolve(rng, "u2", 30, timedelta(hours=2))
+    points = similarity_trend(timeline1, timeline2)
+    assert points
+
+    for point in points:
+        # Latest version of each user at the point's time
+        version1 = (point["at"] - START) // timedelta(hours=5)
+        version2 = (point["at"] - START - timedelta(hours=2)) // timedelta(hours=5)
+        expected = calculate_similarity(
+            CompactProfile(snapshots1[version1]).similarity_input(),
+            CompactProfile(snapshots2[version2]).similarity_input()
+        )
+        assert point["similarity_score"] == expected["similarity_score"]
+        assert point["components"] == pytest.approx(expected["components"])
+
+    final = calculate_similarity(
+        CompactProfile(snapshots1[-1]).similarity_input(),
+        CompactProfile(snapshots2[-1]).similarity_input()
+    )
+    assert points[-1]["similarity_score"] == final["similarity_score"]
+
+
+def test_trend_starts_once_both_users_have_a_keyframe():
+    _, timeline1 = evolve(random.Random(5), "u1", 5, timedelta())
+    _, timeline2 = evolve(random.Random(6), "u2", 5, timedelta(hours=12))
+    points = similarity_trend(timeline1, timeline2)
+    assert points[0]["at"] == timeline2[0]["at"]
+
+
+class FakeUsers:
+    """spotify_users with the conditional update store_snapshot relies on"""
+
+    def __init__(self, doc):
+        self.doc = doc
+
+    async def update_one(self, query, update):
+        # Let concurrent writers interleave between read and write
+        await asyncio.sleep(0)
+        matched = all(self.doc.get(field) == value for field, value in query.items())
+        if matched:
+            self.doc.update(update["$set"])
+            for field, step in update.get("$inc", {}).items():
+                self.doc[field] = self.doc.get(field, 0) + step
+        return SimpleNamespace(matched_count=int(matched))
+
+    async def find_one(self, query, projection=None):
+        return dict(self.doc) if self.doc["id"] == query["id"] else None
+
+
+class FakeEntries:
+    def __init__(self):
+        self.entries = []
+
+    async def insert_one(self, doc):
+        self.entries.append(doc)
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    previous = encode_snapshot([1, 2], [3], [4], {"energy": 0.5})
+    # A re-login kept the snapshot but issued a new id and cleared history_seq
+    users = FakeUsers({"id": "new-id", "profile_snapshot": previous})
+    history = FakeEntries()
+    monkeypatch.setattr(server, "db", SimpleNamespace(spotify_users=users, profile_history=history))
+    return users, history
+
+
+def test_history_restarts_with_a_keyframe_after_login(stored):
+    users, history = stored
+    # Even unchanged taste starts the new id's history
+    snapshot = encode_snapshot([2, 1], [3], [4], {"energy": 0.5})
+    asyncio.run(server.store_snapshot(dict(users.doc), snapshot, "etag"))
+    assert [(entry["seq"], entry["key"]) for entry in history.entries] == [(1, True)]
+    assert list(unpack_ids(history.entries[0]["a"])) == [2, 1]
+    assert users.doc["history_seq"] == 1
+
+    asyncio.run(server.store_snapshot(dict(users.doc), encode_snapshot([2, 1], [3], [4], {"energy": 0.5}), "etag"))
+    assert len(history.entries) == 1
+
+
+def test_concurrent_writes_get_rising_seq_and_time(stored):
+    users, history = stored
+    users.doc["history_seq"] = 3
+    stale = dict(users.doc)
+    # Encoded in one order, written in the other
+    snapshots = [encode_snapshot([1, 2, n], [3], [4], {"energy": 0.5}, START) for n in (10, 11, 12)]
+
+    async def refresh_all():
+        await asyncio.gather(*(server.store_snapshot(dict(stale), snapshot, "etag") for snapshot in reversed(snapshots)))
+
+    asyncio.run(refresh_all())
+    assert [entry["seq"] for entry in history.entries] == [4, 5, 6]
+    times = [entry["at"] for entry in history.entries]
+    assert times == sorted(times) and times[0] > START.replace(tzinfo=timezone.utc)
+    assert users.doc["history_seq"] == 6
+
+
+@pytest.mark.parametrize("age, cache_control", [
+    (timedelta(days=2), "private, max-age=3600"),
+    (timedelta(), "private, no-cache"),
+    (-timedelta(days=1), "private, no-cache"),
+])
+def test_history_cached_only_for_a_settled_past(monkeypatch, age, cache_control):
+    async def reconstruct(db, user_id, at):
+        return {"top_artist_ids": [], "top_track_ids": [], "genre_ids": [], "audio_features": {}}
+
+    async def lookup(item_ids):
+        return []
+
+    monkeypatch.setattr(server, "reconstruct", reconstruct)
+    monkeypatch.setattr(server.interner, "lookup", lookup)
+    at = (datetime.now(timezone.utc) - age).isoformat()
+    response = TestClient(server.app).get("/api/user/u1/history", params={"at": at})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == cache_control
@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+from recommendations import CooccurrenceRecommender, item_key, profile_vector
+
+
+def random_profile(rng: random.Random):
+    artists = [{"id": f"a{i}", "name": f"Artist {i}"} for i in rng.sample(range(30), rng.randint(1, 10))]
+    tracks = [{"id": f"t{i}", "name": f"Track {i}", "artists": []} for i in rng.sample(range(60), rng.randint(0, 10))]
+    return artists, tracks
+
+
+def build(profiles):
+    recommender = CooccurrenceRecommender()
+    for user_id, (artists, tracks) in profiles.items():
+        recommender.update_user(user_id, artists, tracks)
+    return recommender
+
+
+def assert_same_matrix(incremental: CooccurrenceRecommender, rebuilt: CooccurrenceRecommender):
+    assert incremental.user_vectors == rebuilt.user_vectors
+    assert incremental.item_users == rebuilt.item_users
+    assert incremental.item_norms == pytest.approx(rebuilt.item_norms)
+    # Removals may leave empty rows behind; they carry no similarity
+    incremental_rows = {item: row for item, row in incremental.cooccurrence.items() if row}
+    rebuilt_rows = {item: row for item, row in rebuilt.cooccurrence.items() if row}
+    assert incremental_rows.keys() == rebuilt_rows.keys()
+    for item, row in rebuilt_rows.items():
+        assert incremental_rows[item] == pytest.approx(row)
+
+
+def test_incremental_updates_match_rebuild():
+    rng = random.Random(7)
+    incremental = CooccurrenceRecommender()
+    profiles = {}
+    for _ in range(300):
+        user_id = f"user{rng.randrange(25)}"
+        if user_id in profiles and rng.random() < 0.2:
+            incremental.remove_user(user_id)
+            del profiles[user_id]
+        else:
+            profiles[user_id] = random_profile(rng)
+            incremental.update_user(user_id, *profiles[user_id])
+
+    rebuilt = build(profiles)
+    assert_same_matrix(incremental, rebuilt)
+    for user_id in profiles:
+        expected = rebuilt.recommend(user_id, limit=10)
+        actual = incremental.recommend(user_id, limit=10)
+        assert [item["score"] for item in actual] == pytest.approx([item["score"] for item in expected], abs=1e-4)
+
+
+def test_removing_every_user_empties_the_matrix():
+    rng = random.Random(3)
+    recommender = build({f"user{i}": random_profile(rng) for i in range(10)})
+    for i in range(10):
+        recommender.remove_user(f"user{i}")
+
+    assert len(recommender) == 0
+    assert recommender.item_users == {}
+    assert recommender.item_norms == {}
+    assert all(not row for row in recommender.cooccurrence.values())
+
+
+def test_recommend_skips_known_items_and_boosts_partner():
+    recommender = build({
+        "alice": ([{"id": "a1"}, {"id": "a2"}], []),
+        "bob": ([{"id": "a1"}, {"id": "a3"}], []),
+        "carol": ([{"id": "a4"}], [{"id": "t1"}]),
+    })
+
+    recommended = recommender.recommend("alice")
+    assert [item["id"] for item in recommended] == ["a3"]
+
+    boosted = recommender.recommend("alice", boost_user_id="carol")
+    assert {item["id"] for item in boosted} == {"a3", "a4", "t1"}
+    assert recommender.recommend("alice", item_type="track", boost_user_id="carol")[0]["type"] == "track"
+
+
+def test_profile_vector_weights_by_rank_and_skips_missing_ids():
+    vector = profile_vector([{"id": "x"}, {"id": None}, {"id": "y"}], [{"id": "x"}])
+    assert vector[item_key("artist", "x")] == 1.0
+    assert vector[item_key("artist", "y")] == pytest.approx(0.5)
+    assert vector[item_key("track", "x")] == 1.0
+    assert len(vector) == 3
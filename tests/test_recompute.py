@@ -0,0 +1,166 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import recompute
+from profile_codec import AUDIO_FEATURES, CompactProfile, encode_snapshot, is_compact
+from recompute import legacy_updated_at, recompute_snapshots, score_pairs
+from similarity import calculate_similarity, unpack_components
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for the recompute jobs"""
+
+    def __init__(self, docs=()):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.fail_on_write = None
+        self.writes = 0
+
+    @staticmethod
+    def _matches(doc, query):
+        for field, condition in query.items():
+            if isinstance(condition, dict):
+                if "$exists" in condition and (field in doc) != condition["$exists"]:
+                    return False
+                if "$gt" in condition and not doc.get(field) > condition["$gt"]:
+                    return False
+            elif doc.get(field) != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs.values() if self._matches(doc, query)])
+
+    async def find_one(self, query):
+        return next((dict(doc) for doc in self.docs.values() if self._matches(doc, query)), None)
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"]})
+        doc.update(update["$set"])
+
+    async def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+    async def bulk_write(self, operations, ordered=True):
+        self.writes += 1
+        if self.writes == self.fail_on_write:
+            raise ConnectionError("primary stepped down")
+        for operation in operations:
+            self.docs[operation._filter["_id"]].update(operation._doc["$set"])
+
+
+class StubInterner:
+    """Interns keys to sequential ids without touching spotify_items"""
+
+    ids = {}
+
+    def __init__(self, db):
+        pass
+
+    async def ensure_indexes(self):
+        pass
+
+    async def intern(self, kind, items):
+        keys = [f"{kind}:{item if kind == 'genre' else item['id']}" for item in items]
+        return [self.ids.setdefault(key, len(self.ids) + 1) for key in keys]
+
+
+def legacy_user(i: int):
+    rng = random.Random(i)
+    return {
+        "_id": i,
+        "id": f"user-{i}",
+        "profile_snapshot": {
+            "top_artists": [{"id": f"artist{n}", "name": f"Artist {n}"} for n in rng.sample(range(30), 5)],
+            "top_tracks": [{"id": f"track{n}", "name": f"Track {n}"} for n in rng.sample(range(60), 5)],
+            "genres": [f"genre{n}" for n in rng.sample(range(10), 3)],
+            "audio_features": {feature: rng.random() for feature in AUDIO_FEATURES},
+            "updated_at": (datetime(2026, 3, 1, tzinfo=timezone.utc) + timedelta(days=i)).isoformat(),
+        },
+    }
+
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(recompute, "ItemInterner", StubInterner)
+    users = [legacy_user(i) for i in range(1, 8)]
+    users.append({"_id": 8, "id": "user-8", "profile_snapshot": encode_snapshot([1], [2], [3], {})})
+    users.append({"_id": 9, "id": "user-9"})
+    return SimpleNamespace(spotify_users=FakeCollection(users), recompute_checkpoints=FakeCollection())
+
+
+def test_legacy_updated_at_parses_stored_strings():
+    aware = datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)
+    assert legacy_updated_at({"updated_at": aware.isoformat()}) == aware
+    assert legacy_updated_at({"updated_at": "2026-03-01T12:30:00"}) == aware
+    assert legacy_updated_at({"updated_at": aware.replace(tzinfo=None)}) == aware
+    assert legacy_updated_at({"updated_at": "yesterday"}) is None
+    assert legacy_updated_at({}) is None
+
+
+def test_snapshots_are_reencoded_with_their_original_timestamp(db):
+    legacy = {doc["_id"]: doc["profile_snapshot"] for doc in db.spotify_users.docs.values() if "profile_snapshot" in doc}
+    asyncio.run(recompute_snapshots(db, SimpleNamespace(batch_size=3)))
+
+    for user_id, doc in db.spotify_users.docs.items():
+        if user_id == 9:
+            assert "profile_snapshot" not in doc
+            continue
+        snapshot = doc["profile_snapshot"]
+        assert is_compact(snapshot)
+        if user_id == 8:
+            assert snapshot == legacy[8]
+            continue
+        profile = CompactProfile(snapshot)
+        assert profile.updated_at == legacy_updated_at(legacy[user_id])
+        assert len(profile.artist_ids) == 5 and len(profile.genre_ids) == 3
+        assert profile.audio_features == pytest.approx(legacy[user_id]["audio_features"], rel=1e-6)
+    assert db.recompute_checkpoints.docs == {}
+
+
+def test_snapshot_job_resumes_after_a_failed_batch(db):
+    db.spotify_users.fail_on_write = 2
+    with pytest.raises(ConnectionError):
+        asyncio.run(recompute_snapshots(db, SimpleNamespace(batch_size=3)))
+    assert db.recompute_checkpoints.docs["snapshots"]["last_id"] == 3
+    assert not is_compact(db.spotify_users.docs[4]["profile_snapshot"])
+
+    asyncio.run(recompute_snapshots(db, SimpleNamespace(batch_size=3)))
+    assert all(is_compact(doc["profile_snapshot"]) for doc in db.spotify_users.docs.values() if "profile_snapshot" in doc)
+    assert db.recompute_checkpoints.docs == {}
+
+
+def test_score_pairs_matches_calculate_similarity():
+    rng = random.Random(7)
+    snapshots = [
+        encode_snapshot(rng.sample(range(40), 10), rng.sample(range(80), 10), rng.sample(range(15), 4),
+                        {feature: rng.random() for feature in AUDIO_FEATURES})
+        for _ in range(6)
+    ]
+    pairs = [(i, snapshots[i], snapshots[(i + 1) % 6]) for i in range(6)]
+    for (comparison_id, score, components), (_, first, second) in zip(score_pairs(pairs), pairs):
+        expected = calculate_similarity(CompactProfile(first).similarity_input(), CompactProfile(second).similarity_input())
+        assert score == expected["similarity_score"]
+        assert unpack_components(components) == pytest.approx(expected["components"], abs=1e-6)
@@ -0,0 +1,99 @@
+import random
+
+import numpy as np
+import pytest
+
+from profile_codec import AUDIO_FEATURES
+from similarity import (
+    COMPONENTS,
+    DEFAULT_WEIGHTS,
+    calculate_similarity,
+    pack_components,
+    score_matrix,
+    unpack_components,
+    weight_vector,
+)
+
+
+def random_user(rng: random.Random):
+    features = {feature: rng.random() for feature in AUDIO_FEATURES}
+    features["tempo"] = rng.uniform(40, 240)
+    return {
+        "top_artists": [{"id": f"a{i}"} for i in rng.sample(range(40), rng.randint(0, 20))],
+        "top_tracks": [{"id": f"t{i}"} for i in rng.sample(range(80), rng.randint(0, 20))],
+        "genres": [f"g{i}" for i in rng.sample(range(20), rng.randint(0, 10))],
+        "audio_features": features,
+    }
+
+
+def random_pairs(seed: int, count: int):
+    rng = random.Random(seed)
+    return [calculate_similarity(random_user(rng), random_user(rng)) for _ in range(count)]
+
+
+def test_score_matrix_with_default_weights_equals_similarity_score():
+    comparisons = random_pairs(5, 500)
+    scores = score_matrix([pack_components(comparison["components"]) for comparison in comparisons])
+    assert scores.tolist() == [comparison["similarity_score"] for comparison in comparisons]
+
+
+def test_custom_weights_rescore_without_recomputing():
+    comparisons = random_pairs(9, 50)
+    packed = [pack_components(comparison["components"]) for comparison in comparisons]
+
+    artist_only = score_matrix(packed, {"artist": 1, "track": 0, "genre": 0, "audio": 0})
+    expected = [round(comparison["components"]["artist"] * 100, 1) for comparison in comparisons]
+    assert artist_only.tolist() == pytest.approx(expected, abs=0.05)
+
+    tempo_only = score_matrix(packed, {"artist": 0, "track": 0, "genre": 0, "audio": 0, "audio_tempo": 3})
+    expected = [round(comparison["components"]["audio_tempo"] * 100, 1) for comparison in comparisons]
+    assert tempo_only.tolist() == pytest.approx(expected, abs=0.05)
+
+
+def test_weight_vector_defaults():
+    vector = weight_vector()
+    assert vector.sum() == pytest.approx(1)
+    named = dict(zip(COMPONENTS, vector))
+    assert named["artist"] == pytest.approx(DEFAULT_WEIGHTS["artist"])
+    assert named["genre"] == pytest.approx(DEFAULT_WEIGHTS["genre"])
+    assert named["audio_tempo"] == pytest.approx(DEFAULT_WEIGHTS["audio"] / len(AUDIO_FEATURES))
+
+
+def test_weight_vector_normalizes_custom_weights():
+    named = dict(zip(COMPONENTS, weight_vector({"artist": 2, "track": 2, "genre": 0, "audio": 0})))
+    assert named["artist"] == pytest.approx(0.5)
+    assert named["audio_energy"] == 0
+
+
+@pytest.mark.parametrize("weights", [
+    {"popularity": 1},
+    {"artist": -1},
+    {"artist": 0, "track": 0, "genre": 0, "audio": 0},
+])
+def test_weight_vector_rejects_bad_weights(weights):
+    with pytest.raises(ValueError):
+        weight_vector(weights)
+
+
+def test_components_round_trip():
+    components = random_pairs(2, 1)[0]["components"]
+    assert list(unpack_components(pack_components(components))) == COMPONENTS
+    assert unpack_components(pack_components(components)) == pytest.approx(components, abs=1e-6)
+
+
+def test_identical_and_disjoint_profiles():
+    user = random_user(random.Random(4))
+    same = calculate_similarity(user, user)
+    assert same["similarity_score"] == 100
+    assert all(value == pytest.approx(1) for value in same["components"].values())
+
+    other = {"top_artists": [{"id": "x"}], "top_tracks": [{"id": "y"}], "genres": ["z"],
+             "audio_features": {feature: 1 - user["audio_features"][feature] for feature in AUDIO_FEATURES}}
+    disjoint = calculate_similarity(user, other)
+    assert disjoint["shared_artists"] == disjoint["shared_tracks"] == disjoint["shared_genres"] == []
+    assert disjoint["components"]["artist"] == disjoint["components"]["genre"] == 0
+
+
+def test_empty_score_matrix():
+    assert score_matrix([]).shape == (0,)
+    assert isinstance(score_matrix([pack_components(random_pairs(1, 1)[0]["components"])]), np.ndarray)
@@ -0,0 +1,101 @@
+import random
+
+import pytest
+
+from profile_codec import AUDIO_FEATURES, CompactProfile, encode_snapshot
+from similarity import calculate_similarity, pack_components, score_matrix
+from vector_store import MappedStore, SharedVectorStore, WriterLock, write_store
+
+
+def random_rows(seed: int, count: int):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        features = {feature: rng.random() for feature in AUDIO_FEATURES}
+        features["tempo"] = rng.uniform(40, 240)
+        snapshot = encode_snapshot(
+            rng.sample(range(60), rng.randint(0, 20)),
+            rng.sample(range(200), rng.randint(0, 20)),
+            rng.sample(range(25), rng.randint(0, 8)),
+            features if rng.random() > 0.1 else {}
+        )
+        rows.append((f"user-{i:03d}", CompactProfile(snapshot)))
+    return rows
+
+
+@pytest.fixture
+def store_rows(tmp_path):
+    rows = random_rows(11, 80)
+    path = tmp_path / "profile_vectors.bin"
+    write_store(path, rows)
+    return MappedStore(path), dict(rows)
+
+
+def test_similar_users_match_calculate_similarity(store_rows):
+    store, profiles = store_rows
+    for user_id in list(profiles)[:10]:
+        matches = store.similar_users(user_id, limit=len(profiles))
+        assert len(matches) == len(profiles) - 1
+        assert user_id not in dict(matches)
+        for other_id, score in matches:
+            expected = calculate_similarity(profiles[user_id].similarity_input(), profiles[other_id].similarity_input())
+            assert score == expected["similarity_score"], (user_id, other_id)
+
+
+def test_similar_users_are_ranked_and_limited(store_rows):
+    store, profiles = store_rows
+    user_id = next(iter(profiles))
+    matches = store.similar_users(user_id, limit=5)
+    scores = [score for _, score in matches]
+    assert len(matches) == 5
+    assert scores == sorted(scores, reverse=True)
+    assert scores[0] == max(score for _, score in store.similar_users(user_id, limit=len(profiles)))
+
+
+def test_custom_weights_match_stored_components(store_rows):
+    store, profiles = store_rows
+    weights = {"artist": 1, "genre": 2, "audio_tempo": 0.5}
+    user_id = next(iter(profiles))
+    for other_id, score in store.similar_users(user_id, limit=20, weights=weights):
+        components = calculate_similarity(profiles[user_id].similarity_input(), profiles[other_id].similarity_input())["components"]
+        assert score == float(score_matrix([pack_components(components)], weights)[0])
+
+
+def test_lookup_of_unknown_user(store_rows):
+    store, _ = store_rows
+    assert store.row("nobody") is None
+    assert store.similar_users("nobody") == []
+
+
+def test_readers_follow_an_atomic_swap(tmp_path):
+    path = tmp_path / "profile_vectors.bin"
+    shared = SharedVectorStore(path)
+    assert shared.current() is None
+
+    write_store(path, random_rows(1, 10))
+    first = shared.current()
+    assert first.n_users == 10
+    assert shared.current() is first
+
+    write_store(path, random_rows(2, 25))
+    assert shared.current().n_users == 25
+    # Views over the previous mapping stay readable
+    assert first.n_users == 10 and first.row("user-000") == 0
+
+
+def test_empty_store(tmp_path):
+    path = tmp_path / "profile_vectors.bin"
+    write_store(path, [])
+    store = MappedStore(path)
+    assert store.n_users == 0
+    assert store.similar_users("user-000") == []
+
+
+def test_writer_lock_is_exclusive(tmp_path):
+    path = tmp_path / "profile_vectors.bin"
+    first, second = WriterLock(path), WriterLock(path)
+    assert first.acquire()
+    assert not second.acquire()
+    first.release()
+    assert second.acquire()
+    second.release()
@@ -0,0 +1,70 @@
+import asyncio
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+from pymongo.errors import AutoReconnect, OperationFailure
+
+import server
+
+
+class FakeCollection:
+    def __init__(self, name, db):
+        self.name = name
+        self.db = db
+
+    async def create_index(self, keys, **options):
+        if self.db.down:
+            raise AutoReconnect("connection refused")
+        if self.name in self.db.rejected:
+            raise OperationFailure("E11000 duplicate key error", code=11000)
+        self.db.created.append(self.name)
+
+
+class FakeDb:
+    def __init__(self, down=False, rejected=()):
+        self.down = down
+        self.rejected = set(rejected)
+        self.created = []
+
+    def __getattr__(self, name):
+        return FakeCollection(name, self)
+
+
+def use_db(monkeypatch, fake):
+    monkeypatch.setattr(server, "db", fake)
+    monkeypatch.setattr(server.interner, "db", fake)
+
+
+def test_rejected_index_does_not_stop_the_others(monkeypatch):
+    fake = FakeDb(rejected={"comparisons"})
+    use_db(monkeypatch, fake)
+    app = SimpleNamespace(state=SimpleNamespace())
+    asyncio.run(server.build_indexes(app))
+    assert app.state.indexes == "failed: comparisons.user1_id_user2_id, comparisons.user2_id"
+    assert fake.created == ["spotify_items", "profile_history", "spotify_users", "listening_stats"]
+
+
+def test_readiness_does_not_wait_for_indexes(monkeypatch):
+    fake = FakeDb(down=True)
+    use_db(monkeypatch, fake)
+    app = SimpleNamespace(state=SimpleNamespace(indexes="building"))
+
+    async def scenario():
+        builder = asyncio.create_task(server.build_indexes(app))
+        await server.warm_up(app, preload=False)
+        assert app.state.ready and app.state.indexes == "building"
+        # Mongo comes back: the builder's next retry finishes the job
+        fake.down = False
+        await asyncio.wait_for(builder, 3)
+
+    asyncio.run(scenario())
+    assert app.state.indexes == "ready"
+    assert len(fake.created) == 6
+
+
+def test_readyz_reports_index_state(monkeypatch):
+    monkeypatch.setattr(server.app.state, "ready", True, raising=False)
+    monkeypatch.setattr(server.app.state, "indexes", "failed: comparisons.user2_id", raising=False)
+    response = TestClient(server.app).get("/readyz")
+    assert response.status_code == 200
+    assert response.json()["indexes"] == "failed: comparisons.user2_id"
@@ -0,0 +1,180 @@
+import asyncio
+
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from write_behind import WriteBehindBuffer
+
+
+class FakeCollection:
+    """Records bulk_write batches and applies them in order, failing on request"""
+
+    def __init__(self):
+        self.batches = []
+        self.docs = []
+        self.gate = None
+        self.error = None
+
+    async def bulk_write(self, operations, ordered=True):
+        assert ordered
+        self.batches.append([operation._doc["n"] for operation in operations])
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        for index, operation in enumerate(operations):
+            if operation._doc.get("bad"):
+                raise BulkWriteError({
+                    "writeErrors": [{"index": index, "code": 11000, "errmsg": "E11000 duplicate key"}],
+                    "writeConcernErrors": [],
+                    "nInserted": index,
+                })
+            self.docs.append(operation._doc["n"])
+
+
+class FakeDb(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        return collection
+
+
+def insert(n, **fields):
+    return InsertOne({"n": n, **fields})
+
+
+def run(scenario):
+    return asyncio.run(scenario())
+
+
+def test_flushes_full_batches_without_waiting():
+    db = FakeDb()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db, max_batch=3, flush_interval=10)
+        buffer.start()
+        for n in range(7):
+            await buffer.submit("comparisons", insert(n))
+        await asyncio.sleep(0.05)
+        assert db["comparisons"].batches == [[0, 1, 2], [3, 4, 5]]
+        await buffer.close()
+        return buffer
+
+    buffer = run(scenario)
+    assert db["comparisons"].batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert buffer.written == 7 and buffer.failed == 0
+
+
+def test_partial_batch_flushes_after_interval():
+    db = FakeDb()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db, max_batch=100, flush_interval=0.05)
+        buffer.start()
+        await buffer.submit("comparisons", insert(0))
+        await buffer.submit("comparisons", insert(1))
+        await asyncio.sleep(0.01)
+        assert db["comparisons"].batches == []
+        await asyncio.sleep(0.1)
+        assert db["comparisons"].batches == [[0, 1]]
+        await buffer.close()
+
+    run(scenario)
+
+
+def test_full_queue_pushes_back_on_submit():
+    db = FakeDb()
+
+    async def scenario():
+        db["comparisons"].gate = asyncio.Event()
+        buffer = WriteBehindBuffer(db, max_batch=1, flush_interval=0.01, max_pending=2)
+        buffer.start()
+        await buffer.submit("comparisons", insert(0))
+        await asyncio.sleep(0.01)
+        # The flusher is stuck writing 0; two more fill the queue
+        await buffer.submit("comparisons", insert(1))
+        await buffer.submit("comparisons", insert(2))
+        blocked = asyncio.create_task(buffer.submit("comparisons", insert(3)))
+        await asyncio.sleep(0.05)
+        assert not blocked.done()
+        assert buffer.queue.qsize() == 2
+
+        db["comparisons"].gate.set()
+        await asyncio.wait_for(blocked, 1)
+        await buffer.close()
+        return buffer
+
+    buffer = run(scenario)
+    assert db["comparisons"].docs == [0, 1, 2, 3]
+    assert buffer.written == 4
+
+
+def test_close_drains_everything_queued():
+    db = FakeDb()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db, max_batch=50, flush_interval=10)
+        buffer.start()
+        for n in range(120):
+            await buffer.submit("comparisons" if n % 2 else "other", insert(n))
+        await buffer.close()
+        assert buffer.task is None
+        # Once closed, writes go straight through
+        await buffer.submit("comparisons", insert(999))
+        return buffer
+
+    buffer = run(scenario)
+    assert db["other"].docs == list(range(0, 120, 2))
+    assert db["comparisons"].docs == list(range(1, 120, 2)) + [999]
+    assert buffer.written == 121
+
+
+def test_failed_operation_is_skipped_and_the_rest_written_in_order():
+    db = FakeDb()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db)
+        await buffer._bulk_write("comparisons", [insert(0), insert(1, bad=True), insert(2), insert(3, bad=True), insert(4)])
+        return buffer
+
+    buffer = run(scenario)
+    assert db["comparisons"].docs == [0, 2, 4]
+    assert db["comparisons"].batches == [[0, 1, 2, 3, 4], [2, 3, 4], [4]]
+    assert (buffer.written, buffer.failed) == (3, 2)
+
+
+def test_write_concern_error_alone_counts_as_written():
+    db = FakeDb()
+
+    async def scenario():
+        db["comparisons"].error = BulkWriteError({
+            "writeErrors": [],
+            "writeConcernErrors": [{"code": 64, "errmsg": "waiting for replication timed out"}],
+            "nInserted": 3,
+        })
+        buffer = WriteBehindBuffer(db)
+        await buffer._bulk_write("comparisons", [insert(0), insert(1), insert(2)])
+        return buffer
+
+    buffer = run(scenario)
+    assert len(db["comparisons"].batches) == 1
+    assert (buffer.written, buffer.failed) == (3, 0)
+
+
+def test_driver_error_fails_the_batch_and_the_flusher_keeps_going():
+    db = FakeDb()
+
+    async def scenario():
+        buffer = WriteBehindBuffer(db, max_batch=2, flush_interval=0.01)
+        buffer.start()
+        db["comparisons"].error = AutoReconnect("connection reset")
+        await buffer.submit("comparisons", insert(0))
+        await buffer.submit("comparisons", insert(1))
+        await asyncio.sleep(0.05)
+        db["comparisons"].error = None
+        await buffer.submit("comparisons", insert(2))
+        await buffer.close()
+        return buffer
+
+    buffer = run(scenario)
+    assert db["comparisons"].docs == [2]
+    assert (buffer.written, buffer.failed) == (1, 2)